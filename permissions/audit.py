@@ -0,0 +1,257 @@
+"""Asynchronous, batched audit logging of permission decisions.
+
+An :class:`AuditLog` can be passed to a registry via its ``audit_log``
+option. Each permission decision made by a view decorator is then
+handed to the log, which records all denials and a random sample of
+allows. Records are put into a bounded queue and written in batches to
+a sink by a background thread so that request handling isn't slowed
+down by writes.
+
+A sink is any object with a ``write(records)`` method. It may also
+have a ``close()`` method, which will be called when the log is closed.
+A few sinks are provided: :class:`DatabaseSink`, :class:`JSONLinesSink`,
+and :class:`LoggingSink`.
+
+"""
+import atexit
+import json
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.db import close_old_connections
+from six.moves import queue
+
+
+log = logging.getLogger(__name__)
+
+
+AuditRecord = namedtuple('AuditRecord', (
+    'timestamp', 'permission', 'allowed', 'user_id', 'instance_key', 'view'
+))
+
+
+_STOP = object()
+
+
+class _Flush(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class AuditLog(object):
+
+    """Records permission decisions in the background.
+
+    Args:
+
+        - sink: Where records are written (see module docs).
+
+        - sample_rate: Fraction of allowed decisions to record; denials
+          are always recorded. [0.0]
+
+        - batch_size: Write records when this many are pending. [100]
+
+        - flush_interval: Write pending records at least this often, in
+          seconds. [1.0]
+
+        - max_queue_size: Maximum number of records waiting to be
+          written. When the queue is full, new records are dropped (and
+          counted) after waiting up to ``put_timeout`` seconds. [10000]
+
+        - put_timeout: How long a request may wait for space in a full
+          queue. The default is to not wait at all. [0]
+
+    The worker thread is started when the first record is added. It's
+    drained and stopped by :meth:`close`, which is also registered to
+    run at interpreter exit.
+
+    """
+
+    def __init__(self, sink, sample_rate=0.0, batch_size=100, flush_interval=1.0,
+                 max_queue_size=10000, put_timeout=0):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def should_record(self, allowed):
+        """Decide whether a decision should be recorded.
+
+        This is cheap and is called before a record is constructed.
+
+        """
+        return not allowed or (self.sample_rate and random.random() < self.sample_rate)
+
+    def record(self, permission, allowed, user=None, instance_key=None, view=None):
+        """Add a decision to the queue if it's sampled."""
+        if self.should_record(allowed):
+            self.add(permission, allowed, user, instance_key, view)
+
+    def add(self, permission, allowed, user=None, instance_key=None, view=None):
+        """Add a decision to the queue without sampling it."""
+        if self._closed:
+            return
+        user_id = getattr(user, 'pk', None)
+        record = AuditRecord(time.time(), permission, bool(allowed), user_id, instance_key, view)
+        self._ensure_started()
+        try:
+            if self.put_timeout:
+                self._queue.put(record, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+        else:
+            with self._lock:
+                self.recorded += 1
+
+    def flush(self, timeout=None):
+        """Block until records queued so far have been written.
+
+        Returns ``False`` if the worker didn't finish in time.
+
+        """
+        if self._thread is None:
+            return True
+        marker = _Flush()
+        self._queue.put(marker, timeout=timeout)
+        return marker.event.wait(timeout)
+
+    def close(self, timeout=None):
+        """Write remaining records and stop the worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        close_sink = getattr(self.sink, 'close', None)
+        if close_sink is not None:
+            close_sink()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name='permissions-audit')
+                thread.daemon = True
+                thread.start()
+                atexit.register(self.close)
+                self._thread = thread
+
+    def _run(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._write(batch)
+                return
+            elif isinstance(item, _Flush):
+                self._write(batch)
+                batch = []
+                item.event.set()
+            elif item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.time() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.time() + self.flush_interval
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            # The worker is long-lived, so connections that have expired
+            # (CONN_MAX_AGE) or been dropped by the server have to be
+            # replaced, as Django does at request boundaries.
+            close_old_connections()
+            try:
+                self.sink.write(batch)
+            finally:
+                close_old_connections()
+        except Exception:
+            log.exception('Could not write {0} audit records'.format(len(batch)))
+            with self._lock:
+                self.failed += len(batch)
+        else:
+            with self._lock:
+                self.written += len(batch)
+
+
+class DatabaseSink(object):
+
+    """Writes records to a model using ``bulk_create``.
+
+    By default, each record's fields are passed as keyword args to
+    ``model``. Pass ``to_kwargs`` to customize this; it will be called
+    with each record and should return a dict.
+
+    """
+
+    def __init__(self, model, to_kwargs=None):
+        self.model = model
+        self.to_kwargs = to_kwargs or (lambda record: record._asdict())
+
+    def write(self, records):
+        self.model._default_manager.bulk_create(
+            [self.model(**self.to_kwargs(r)) for r in records])
+
+
+class JSONLinesSink(object):
+
+    """Appends records to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def write(self, records):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        for record in records:
+            self._file.write(json.dumps(record._asdict(), default=str))
+            self._file.write('\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LoggingSink(object):
+
+    """Writes each record to a logger."""
+
+    def __init__(self, logger='permissions.audit.records', level=logging.INFO):
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.level = level
+
+    def write(self, records):
+        for record in records:
+            self.logger.log(
+                self.level, '{0} {1} user={2} instance={3} view={4}'.format(
+                    'ALLOW' if record.allowed else 'DENY', record.permission, record.user_id,
+                    record.instance_key, record.view))
@@ -0,0 +1,181 @@
+"""Capability manifests for client-side code.
+
+A capability manifest tells a client (e.g., a single page app) which
+of a set of permissions the current user has, for the user as a whole
+and for a set of objects, so it doesn't have to ask one permission and
+one object at a time.
+
+Only permissions registered with ``expose=True`` can be included.
+Objects are referenced as ``app_label.model_name:pk``. A manifest looks
+like this::
+
+    {
+        "permissions": ["can_create_widget", "can_edit_widget", "can_delete_widget"],
+        "user": 1,
+        "objects": {"widgets.widget:1": 6, "widgets.widget:2": 2}
+    }
+
+Results are bitsets: bit ``i`` is set when permission ``i`` (in the
+order of ``permissions``) is granted. ``user`` has the results for
+permissions that don't have a model. Each object has the results for
+permissions with a model that matches the object's; other bits are
+never set. Objects that don't exist have no bits set. Objects must be
+instances of the model of one of the requested permissions, and the
+number of permissions and objects per request is limited (see
+:data:`MAX_PERMISSIONS` and :data:`MAX_OBJECTS`).
+
+Use :meth:`PermissionsRegistry.capabilities` and
+:attr:`PermissionsRegistry.capabilities_view` rather than the functions
+here directly.
+
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .exc import NoSuchPermissionError, PermissionsError
+
+
+MAX_PERMISSIONS = 64
+
+MAX_OBJECTS = 1000
+
+
+def parse_ref(ref):
+    """Parse an object reference into a ``(model, pk)`` pair."""
+    try:
+        label, pk = ref.split(':', 1)
+        app_label, model_name = label.split('.')
+        model = apps.get_model(app_label, model_name)
+        pk = model._meta.pk.to_python(pk)
+    except (ValueError, LookupError, ValidationError):
+        raise PermissionsError('Bad object reference: {0}'.format(ref))
+    return model, pk
+
+
+def get_manifest(registry, user, perm_names, refs, max_permissions=MAX_PERMISSIONS,
+                 max_objects=MAX_OBJECTS):
+    """Evaluate ``perm_names`` for ``user`` and the objects in ``refs``.
+
+    Permissions are checked in bulk: instances of each model are loaded
+    in a single query and each permission is checked for all of them at
+    once (see :meth:`PermissionsRegistry.filter` for how). Raises
+    :class:`PermissionsError` if a permission isn't exposed, if
+    a reference is bad or refers to a model that none of the
+    permissions apply to, or if there are too many permissions or
+    references. All of this is checked before any queries are made.
+
+    """
+    perm_names, refs = list(perm_names), list(refs)
+    if len(perm_names) > max_permissions:
+        raise PermissionsError('Too many permissions (max {0})'.format(max_permissions))
+    if len(refs) > max_objects:
+        raise PermissionsError('Too many objects (max {0})'.format(max_objects))
+    perm_names = list(OrderedDict.fromkeys(perm_names))
+    refs = list(OrderedDict.fromkeys(refs))
+
+    entries = []
+    for name in perm_names:
+        try:
+            entry = registry._get_entry(name)
+        except NoSuchPermissionError:
+            entry = None
+        if entry is None or not entry.expose:
+            # Don't reveal whether unexposed permissions exist.
+            raise PermissionsError('Permission not exposed: {0}'.format(name))
+        entries.append(entry)
+
+    models = set(entry.model for entry in entries if entry.model is not None)
+    pks_by_model = OrderedDict()
+    ref_keys = []
+    for ref in refs:
+        model, pk = parse_ref(ref)
+        if model not in models:
+            raise PermissionsError(
+                'None of the requested permissions apply to object: {0}'.format(ref))
+        pks_by_model.setdefault(model, []).append(pk)
+        ref_keys.append((ref, model, pk))
+
+    registry._prefetch_for(user, perm_names)
+    user_bits = 0
+    object_bits = dict(((model, pk), 0) for (ref, model, pk) in ref_keys)
+    for model, pks in pks_by_model.items():
+        instances = list(model._default_manager.filter(pk__in=pks))
+        for i, entry in enumerate(entries):
+            if entry.model is not model or not instances:
+                continue
+            results = registry._evaluate_many(entry, user, instances)
+            for instance, result in zip(instances, results):
+                if result:
+                    object_bits[(model, instance.pk)] |= 1 << i
+    for i, entry in enumerate(entries):
+        if entry.model is None and registry._get_wrapped_func(entry.name)(user):
+            user_bits |= 1 << i
+
+    return OrderedDict((
+        ('permissions', perm_names),
+        ('user', user_bits),
+        ('objects', OrderedDict(
+            (ref, object_bits[(model, pk)]) for (ref, model, pk) in ref_keys)),
+    ))
+
+
+def _split(value):
+    return [v for v in (value or '').split(',') if v]
+
+
+def _etag_matches(etag, if_none_match):
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def make_capabilities_view(registry):
+    """Make a view that returns capability manifests as JSON.
+
+    The view takes comma-separated ``perms`` and ``objects`` query
+    params, e.g.
+    ``?perms=can_edit_widget,can_delete_widget&objects=widgets.widget:1``.
+    Responses have an ETag, and a request with a matching
+    ``If-None-Match`` header gets an empty 304 response. The ETag is
+    a digest of the manifest itself because permission results can
+    depend on anything, so a 304 saves bandwidth but not the cost of
+    checking the permissions. A 400 response
+    is returned for permissions that aren't exposed, for bad object
+    references or references to objects none of the permissions apply
+    to, and when too many permissions or objects are requested.
+
+    """
+    def capabilities_view(request):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        perm_names = _split(request.GET.get('perms'))
+        refs = _split(request.GET.get('objects'))
+        try:
+            manifest = get_manifest(registry, request.user, perm_names, refs)
+        except PermissionsError as exc:
+            return HttpResponseBadRequest(str(exc), content_type='text/plain')
+        content = json.dumps(manifest, separators=(',', ':'))
+        etag = '"{0}"'.format(hashlib.sha1(content.encode('utf-8')).hexdigest())
+        if _etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        # The manifest depends on who's asking.
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'Authorization'))
+        return response
+
+    return capabilities_view
@@ -0,0 +1,74 @@
+"""Per-request (and per-task) permission state.
+
+State that's specific to the request being handled is kept in context
+variables rather than on shared objects so that it's isolated between
+threads and between coroutines running in the same thread.
+
+On Python versions without :mod:`contextvars`, a thread-local stand-in
+with the same interface is used instead.
+
+"""
+import threading
+import weakref
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
+
+if ContextVar is None:
+
+    class ContextVar(object):
+
+        """Minimal thread-local stand-in for :class:`contextvars.ContextVar`."""
+
+        _missing = object()
+
+        def __init__(self, name, default=_missing):
+            self.name = name
+            self._default = default
+            self._local = threading.local()
+
+        def get(self, *default):
+            value = getattr(self._local, 'value', self._missing)
+            if value is not self._missing:
+                return value
+            if default:
+                return default[0]
+            if self._default is not self._missing:
+                return self._default
+            raise LookupError(self)
+
+        def set(self, value):
+            token = getattr(self._local, 'value', self._missing)
+            self._local.value = value
+            return token
+
+        def reset(self, token):
+            if token is self._missing:
+                del self._local.value
+            else:
+                self._local.value = token
+
+
+_denied_permission = ContextVar('permissions_denied_permission', default=None)
+
+
+def set_denied_permission(request, perm_name):
+    """Record that ``request`` was denied because of ``perm_name``."""
+    _denied_permission.set((weakref.ref(request), perm_name))
+
+
+def get_denied_permission(request):
+    """Get the name of the permission that denied ``request``.
+
+    This is intended for use in 403 handlers, since Django doesn't
+    pass the :class:`PermissionDenied` exception to them. ``None`` is
+    returned if ``request`` wasn't denied by a permission.
+
+    """
+    value = _denied_permission.get()
+    if value is not None and value[0]() is request:
+        return value[1]
+    return None
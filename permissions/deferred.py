@@ -0,0 +1,52 @@
+"""Deferred permission checks.
+
+See :meth:`permissions.registry.PermissionsRegistry.defer`.
+
+"""
+
+
+class DeferredPermission(object):
+
+    """A permission check whose result is computed later.
+
+    Don't create these directly; use
+    :meth:`PermissionsRegistry.defer` instead.
+
+    A deferred check is truthy or falsy according to its result. The
+    first time any pending check is read, all pending checks (in the
+    current context) are resolved together, so reading one deferred
+    check resolves its siblings too.
+
+    """
+
+    __slots__ = ('registry', 'perm_name', 'user', 'instance', 'resolved', 'result')
+
+    def __init__(self, registry, perm_name, user, instance=None):
+        self.registry = registry
+        self.perm_name = perm_name
+        self.user = user
+        self.instance = instance
+        self.resolved = False
+        self.result = None
+
+    def set_result(self, result):
+        self.resolved = True
+        self.result = bool(result)
+
+    def get_result(self):
+        if not self.resolved:
+            self.registry.resolve_deferred()
+        if not self.resolved:
+            # This check was created in a different context or its
+            # batch failed; check it by itself.
+            self.registry._resolve_deferred_group([self])
+        return self.result
+
+    def __bool__(self):
+        return self.get_result()
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        state = repr(self.result) if self.resolved else 'pending'
+        return '<DeferredPermission {0}: {1}>'.format(self.perm_name, state)
@@ -0,0 +1,77 @@
+"""Django REST Framework integration.
+
+Use :meth:`PermissionsRegistry.drf_permission` and
+:meth:`PermissionsRegistry.drf_filter_backend` rather than the
+functions here directly::
+
+    class WidgetViewSet(viewsets.ModelViewSet):
+
+        queryset = Widget.objects.all()
+        permission_classes = [permissions.drf_permission('can_edit_widget')]
+        filter_backends = [permissions.drf_filter_backend('can_edit_widget')]
+
+"""
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.permissions import BasePermission
+
+from .exc import PermissionsError
+
+
+def make_permission_class(registry, perm_name):
+    """Make a DRF permission class for a registered permission.
+
+    For permissions without a model, the permission is checked in
+    ``has_permission``. For permissions with a model, ``has_permission``
+    only rejects anonymous users (when they're not allowed); the check
+    happens in ``has_object_permission`` using the object DRF already
+    loaded in ``get_object()``, so no additional queries are made.
+
+    Multi-model permissions aren't supported since DRF only passes a
+    single object.
+
+    """
+    entry = registry._get_entry(perm_name)
+    if entry.models:
+        raise PermissionsError(
+            'Multi-model permissions cannot be used as DRF permissions: {0}'.format(perm_name))
+
+    def has_permission(self, request, view):
+        entry = registry._get_entry(perm_name)
+        if entry.model is None:
+            return registry._get_wrapped_func(perm_name)(request.user)
+        return entry.allow_anonymous or not request.user.is_anonymous()
+
+    def has_object_permission(self, request, view, obj):
+        entry = registry._get_entry(perm_name)
+        if entry.model is None:
+            return True
+        return registry._get_wrapped_func(perm_name)(request.user, obj)
+
+    return type(str(perm_name), (BasePermission,), {
+        'perm_name': perm_name,
+        'has_permission': has_permission,
+        'has_object_permission': has_object_permission,
+    })
+
+
+def make_filter_backend(registry, perm_name):
+    """Make a DRF filter backend for a registered permission.
+
+    The backend narrows querysets to objects the requesting user is
+    permitted via :meth:`PermissionsRegistry.filter`. With a
+    ``filter_queryset`` companion or a materialized permission, this
+    adds a single SQL filter to list queries.
+
+    """
+    entry = registry._get_entry(perm_name)
+    if entry.model is None:
+        raise PermissionsError(
+            'Only permissions with a model can be used as filter backends: {0}'.format(perm_name))
+
+    def filter_queryset(self, request, queryset, view):
+        return registry.filter(perm_name, request.user, queryset)
+
+    return type(str('{0}_filter'.format(perm_name)), (BaseFilterBackend,), {
+        'perm_name': perm_name,
+        'filter_queryset': filter_queryset,
+    })
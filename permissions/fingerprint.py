@@ -0,0 +1,45 @@
+"""Permission fingerprints.
+
+A fingerprint is a short string that identifies a set of permissions
+along with a user's results for them. Users with the same results get
+the same fingerprint, so it can be used in place of the user in cache
+keys and ETags for content that depends only on permissions.
+
+See :meth:`permissions.registry.PermissionsRegistry.fingerprint` and
+the ``permissions_fingerprint`` template tag.
+
+"""
+import hashlib
+
+from .exc import PermissionsError
+
+
+def get_fingerprint(funcs, user, instance=None):
+    """Compute a fingerprint from wrapped permission functions.
+
+    ``funcs`` is a dict mapping permission names to wrapped permission
+    functions (i.e., the functions returned by ``register()``).
+    Permissions with a model are checked against ``instance``, which
+    is required if there are any; other permissions are checked for
+    just the user.
+
+    The fingerprint is made up of a digest of the permission names and
+    a bitmask of the results (in order of name), so it doesn't depend
+    on the order the permissions are passed in.
+
+    """
+    names = sorted(funcs)
+    bits = 0
+    for i, name in enumerate(names):
+        func = funcs[name]
+        if getattr(func, 'takes_instance', False):
+            if instance is None:
+                raise PermissionsError(
+                    'An instance is required to fingerprint {0}'.format(name))
+            result = func(user, instance)
+        else:
+            result = func(user)
+        if result:
+            bits |= 1 << i
+    digest = hashlib.sha1(','.join(names).encode('utf-8')).hexdigest()[:8]
+    return '{0}-{1:x}'.format(digest, bits)
@@ -0,0 +1,146 @@
+import multiprocessing
+from itertools import product
+from optparse import make_option
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    from django.utils.module_loading import import_by_path as import_string
+
+from ... import materialize
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _compute_chunk(args):
+    """Compute rows for a block of users and objects.
+
+    This runs in a worker process, so it takes only picklable args and
+    looks up the registry, entry, users, and objects itself.
+
+    """
+    registry_path, perm_name, user_ids, object_ids = args
+    registry = import_string(registry_path)
+    entry = registry._get_entry(perm_name)
+    users = registry._get_user_model()._default_manager.filter(pk__in=user_ids)
+    objects = entry.model._default_manager.filter(pk__in=object_ids)
+    return materialize.compute(entry, users, objects)
+
+
+PROCESSES_HELP = 'Number of worker processes; 0 means compute in this process [CPU count]'
+CHUNK_SIZE_HELP = 'Number of users/objects in each block of work [500]'
+VERIFY_HELP = (
+    'Compare the table against live permission function results instead of rebuilding it')
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Rebuild the materialized permissions table from scratch by evaluating permission '
+        'functions for all users and objects.')
+
+    if django.VERSION[:2] < (1, 8):
+        # Django 1.7 uses optparse; later versions call add_arguments.
+        # Setting args on later versions would add a legacy positional
+        # arg that swallows the registry.
+        args = '<registry> [permission ...]'
+        option_list = BaseCommand.option_list + (
+            make_option(
+                '--processes', type='int', default=multiprocessing.cpu_count(),
+                help=PROCESSES_HELP),
+            make_option('--chunk-size', type='int', default=500, help=CHUNK_SIZE_HELP),
+            make_option('--verify', action='store_true', default=False, help=VERIFY_HELP),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'registry',
+            help='Dotted path to a permissions registry (e.g., my.project.perms.permissions)')
+        parser.add_argument(
+            'permissions', nargs='*', metavar='permission',
+            help='Materialized permissions to rebuild [all]')
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count(), help=PROCESSES_HELP)
+        parser.add_argument('--chunk-size', type=int, default=500, help=CHUNK_SIZE_HELP)
+        parser.add_argument('--verify', action='store_true', default=False, help=VERIFY_HELP)
+
+    def handle(self, *args, **options):
+        if django.VERSION[:2] < (1, 8):
+            # Positional args are passed this way on Django 1.7
+            if not args:
+                raise CommandError('A registry must be specified')
+            options['registry'], options['permissions'] = args[0], list(args[1:])
+        registry_path = options['registry']
+        try:
+            registry = import_string(registry_path)
+        except ImportError as exc:
+            raise CommandError('Could not import registry: {0}'.format(exc))
+
+        names = options['permissions']
+        if not names:
+            names = sorted(n for n, e in registry._registry.items() if e.materialize)
+        entries = [registry._get_entry(n) for n in names]
+        for entry in entries:
+            if not entry.materialize:
+                raise CommandError('Permission is not materialized: {0}'.format(entry.name))
+
+        processes = options['processes']
+        chunk_size = options['chunk_size']
+        failed = []
+
+        for entry in entries:
+            rows = self.compute(registry_path, registry, entry, processes, chunk_size)
+            if options['verify']:
+                if not self.verify(entry, rows):
+                    failed.append(entry.name)
+            else:
+                materialize.store(entry, rows)
+                self.stdout.write('Rebuilt {0}: {1} rows'.format(entry.name, len(rows)))
+
+        if failed:
+            raise CommandError('Verification failed for: {0}'.format(', '.join(failed)))
+
+    def compute(self, registry_path, registry, entry, processes, chunk_size):
+        user_ids = list(
+            registry._get_user_model()._default_manager.values_list('pk', flat=True))
+        object_ids = list(entry.model._default_manager.values_list('pk', flat=True))
+        tasks = [
+            (registry_path, entry.name, u, o)
+            for (u, o) in product(_chunks(user_ids, chunk_size), _chunks(object_ids, chunk_size))
+        ]
+
+        if processes == 0 or len(tasks) < 2:
+            results = [_compute_chunk(task) for task in tasks]
+        else:
+            # Connections must not be shared with forked workers;
+            # each worker will open its own.
+            connections.close_all()
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_compute_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        return [row for result in results for row in result]
+
+    def verify(self, entry, rows):
+        live = set(rows)
+        stored = set(materialize.stored_rows(entry))
+        missing = live - stored
+        extra = stored - live
+        if missing or extra:
+            self.stderr.write('{0}: {1} missing rows, {2} extra rows'.format(
+                entry.name, len(missing), len(extra)))
+            for user_id, object_id in sorted(missing)[:10]:
+                self.stderr.write('  missing: user {0}, object {1}'.format(user_id, object_id))
+            for user_id, object_id in sorted(extra)[:10]:
+                self.stderr.write('  extra: user {0}, object {1}'.format(user_id, object_id))
+            return False
+        self.stdout.write('Verified {0}: {1} rows'.format(entry.name, len(stored)))
+        return True
@@ -0,0 +1,316 @@
+"""Materialized permissions.
+
+A permission registered with ``materialize=True`` has its results
+precomputed into the :class:`permissions.models.MaterializedPermission`
+table. Checks then become indexed lookups and bulk filters become
+subquery joins instead of calls to the permission function.
+
+The table is kept up to date incrementally via model signals (see
+:func:`connect_signals`) and can be rebuilt from scratch with the
+``rebuild_permissions`` management command.
+
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+BATCH_SIZE = 1000
+
+
+# User saves that only update these fields don't trigger a refresh.
+# Django's update_last_login() saves with update_fields=['last_login'].
+IGNORED_USER_FIELDS = frozenset(['last_login'])
+
+
+def _get_model():
+    # Importing the model at module level would cause AppRegistryNotReady
+    # to be raised since this module is imported (via the registry) when
+    # the permissions app is loaded.
+    from .models import MaterializedPermission
+    return MaterializedPermission
+
+
+def _pks(objects):
+    return [getattr(obj, 'pk', obj) for obj in objects]
+
+
+def _instances(model, objects):
+    """Get instances of ``model`` for ``objects``.
+
+    ``objects`` may contain instances and primary keys; instances for
+    the primary keys are loaded in a single query.
+
+    """
+    objects = list(objects)
+    pks = [obj for obj in objects if not isinstance(obj, Model)]
+    if not pks:
+        return objects
+    instances = [obj for obj in objects if isinstance(obj, Model)]
+    instances.extend(model._default_manager.filter(pk__in=pks))
+    return instances
+
+
+def has_permission(entry, user, instance):
+    """Check the materialized table for a single permission result."""
+    model = _get_model()
+    return model.objects.filter(
+        permission=entry.name, user_id=user.pk, object_id=instance.pk).exists()
+
+
+def permitted_ids(entry, user):
+    """Get a queryset of object IDs ``user`` has been granted.
+
+    This is meant to be used as a subquery, e.g. via ``pk__in``, so
+    the filtering happens in the database.
+
+    """
+    model = _get_model()
+    return (
+        model.objects
+        .filter(permission=entry.name, user_id=user.pk)
+        .values_list('object_id', flat=True))
+
+
+def stored_rows(entry):
+    """Get all stored ``(user_id, object_id)`` pairs for ``entry``."""
+    model = _get_model()
+    return model.objects.filter(permission=entry.name).values_list('user_id', 'object_id')
+
+
+def compute(entry, users, objects):
+    """Evaluate ``entry``'s permission function for all pairs.
+
+    Returns a list of ``(user_id, object_id)`` tuples for which the
+    permission is granted.
+
+    """
+    objects = list(objects)
+    return [
+        (user.pk, obj.pk)
+        for user in users
+        for obj in objects
+        if entry.perm_func(user, obj)
+    ]
+
+
+def store(entry, rows, user_ids=None, object_ids=None):
+    """Replace stored results for ``entry`` with ``rows``.
+
+    Existing rows are deleted first. When ``user_ids`` and/or
+    ``object_ids`` are passed, only rows matching them are deleted;
+    otherwise, all rows for the permission are deleted.
+
+    """
+    model = _get_model()
+    with transaction.atomic():
+        existing = model.objects.filter(permission=entry.name)
+        if user_ids is not None:
+            existing = existing.filter(user_id__in=user_ids)
+        if object_ids is not None:
+            existing = existing.filter(object_id__in=object_ids)
+        existing.delete()
+        model.objects.bulk_create(
+            (model(permission=entry.name, user_id=u, object_id=o) for (u, o) in rows),
+            batch_size=BATCH_SIZE)
+
+
+def holders(entry, objects=None):
+    """Get the IDs of users who have been granted ``entry`` for ``objects``.
+
+    ``None`` means all instances of the permission's model.
+
+    """
+    model = _get_model()
+    rows = model.objects.filter(permission=entry.name)
+    if objects is not None:
+        rows = rows.filter(object_id__in=_pks(objects))
+    return set(rows.values_list('user_id', flat=True))
+
+
+def refresh(entry, users=None, objects=None):
+    """Recompute stored results for ``entry``.
+
+    ``users`` and ``objects`` limit what's recomputed; ``None`` means
+    all users or all instances of the permission's model. Either may
+    contain instances or primary keys. If either is empty, nothing is
+    done.
+
+    """
+    user_ids = None if users is None else _pks(users)
+    object_ids = None if objects is None else _pks(objects)
+    if user_ids == [] or object_ids == []:
+        return
+    if users is None:
+        users = get_user_model()._default_manager.all()
+    else:
+        users = _instances(get_user_model(), users)
+    if objects is None:
+        objects = entry.model._default_manager.all()
+    else:
+        objects = _instances(entry.model, objects)
+    rows = compute(entry, users, objects)
+    store(entry, rows, user_ids, object_ids)
+
+
+def remove(entry, users=None, objects=None):
+    """Delete stored results for the specified users and/or objects."""
+    user_ids = None if users is None else _pks(users)
+    object_ids = None if objects is None else _pks(objects)
+    store(entry, (), user_ids, object_ids)
+
+
+def _get_through_rows(through, instance, reverse, pk_set):
+    """Get rows of an auto-created many-to-many ``through`` model.
+
+    These are the rows for ``instance`` and the related objects in
+    ``pk_set`` (or all of them if it's ``None``). Rows for pks in
+    ``pk_set`` are built without querying.
+
+    """
+    source, target = [f for f in through._meta.fields if not f.primary_key]
+    if reverse:
+        source, target = target, source
+    if pk_set is None:
+        return list(through._default_manager.filter(**{source.attname: instance.pk}))
+    return [through(**{source.attname: instance.pk, target.attname: pk}) for pk in pk_set]
+
+
+def connect_signals(registry, entry):
+    """Keep the table for ``entry`` up to date via model signals.
+
+    ``entry.materialize_on`` maps sender models to functions that take
+    the saved or deleted instance and return a ``(users, objects)``
+    pair specifying what to recompute (either may be ``None`` to mean
+    "all"; either may contain instances or primary keys).
+
+    The permission's own model must be included. Recomputing for all
+    users each time an instance is saved would be too slow, so its
+    function says which users may have *gained* permission; rows for
+    users who currently have permission for the returned objects are
+    always recomputed too, since they may have lost it. Deleting an
+    instance removes its rows. For example::
+
+        @permissions.register(
+            model=Widget, materialize=True,
+            materialize_on={
+                Widget: lambda w: (w.team.members.all(), [w]),
+                Membership: lambda m: ([m.user_id], Widget.objects.filter(team=m.team_id)),
+            })
+        def can_edit_widget(user, widget):
+            ...
+
+    Changes to many-to-many relations made via ``add()``,
+    ``remove()``, and ``clear()`` don't send ``post_save`` or
+    ``post_delete``. To handle them, include the relation's through
+    model (e.g., ``User.groups.through``); its function is called with
+    a through row for each pair that's added or removed::
+
+        materialize_on={User.groups.through: lambda row: ([row.user_id], None)}
+
+    Changes to many-to-many relations that aren't declared this way
+    aren't detected.
+
+    Saving or deleting a user refreshes or removes the rows for that
+    user, except that user saves with ``update_fields`` limited to
+    :data:`IGNORED_USER_FIELDS` (e.g., updating ``last_login``) are
+    skipped.
+
+    If the user model is included in ``materialize_on``, its function
+    replaces the default handling of user saves, so it can declare which
+    user changes matter. It can return ``([], [])`` when nothing needs
+    to be recomputed::
+
+        @permissions.register(
+            model=Widget, materialize=True,
+            materialize_on={User: lambda u: ([u], None) if u.is_staff else ([], [])})
+
+    Signal handlers look up the current entry when they're called so
+    re-registering a permission with ``replace=True`` is handled.
+
+    """
+    name = entry.name
+    uid = 'permissions.materialize:{0}:{1}'.format(id(registry), name)
+
+    def current_entry():
+        entry_ = registry._registry.get(name)
+        return entry_ if entry_ is not None and entry_.materialize else None
+
+    def on_object_saved(sender, instance, **kwargs):
+        entry_ = current_entry()
+        if entry_ is not None:
+            resolve = entry_.materialize_on.get(sender)
+            if resolve is None:
+                return
+            users, objects = resolve(instance)
+            if users is not None:
+                users = set(_pks(users)) | holders(entry_, objects)
+            refresh(entry_, users, objects)
+
+    def on_object_deleted(sender, instance, **kwargs):
+        entry_ = current_entry()
+        if entry_ is not None:
+            remove(entry_, objects=[instance])
+
+    def on_user_saved(sender, instance, update_fields=None, **kwargs):
+        if update_fields is not None and set(update_fields) <= IGNORED_USER_FIELDS:
+            return
+        entry_ = current_entry()
+        if entry_ is not None:
+            refresh(entry_, users=[instance])
+
+    def on_user_deleted(sender, instance, **kwargs):
+        entry_ = current_entry()
+        if entry_ is not None:
+            remove(entry_, users=[instance])
+
+    def on_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+        entry_ = current_entry()
+        resolve = entry_ and entry_.materialize_on.get(sender)
+        if resolve is None:
+            return
+        if action in ('post_add', 'post_remove'):
+            rows = _get_through_rows(sender, instance, reverse, pk_set)
+            for users, objects in [resolve(row) for row in rows]:
+                refresh(entry_, users, objects)
+        elif action == 'pre_clear':
+            # The rows are gone after the clear, so they're resolved
+            # now and refreshed after.
+            rows = _get_through_rows(sender, instance, reverse, None)
+            pending_clears[(sender, id(instance))] = [resolve(row) for row in rows]
+        elif action == 'post_clear':
+            for users, objects in pending_clears.pop((sender, id(instance)), ()):
+                refresh(entry_, users, objects)
+
+    pending_clears = {}
+    user_model = registry._get_user_model()
+    materialize_on = entry.materialize_on
+    handlers = [
+        (post_save, on_object_saved, entry.model, 'object'),
+        (post_delete, on_object_deleted, entry.model, 'object'),
+        (post_delete, on_user_deleted, user_model, 'user'),
+    ]
+    if user_model not in materialize_on:
+        handlers.append((post_save, on_user_saved, user_model, 'user'))
+
+    for sender, resolve in materialize_on.items():
+        if sender is entry.model:
+            continue
+
+        def on_trigger(sender, instance, resolve=resolve, **kwargs):
+            entry_ = current_entry()
+            if entry_ is not None:
+                users, objects = resolve(instance)
+                refresh(entry_, users, objects)
+        key = '{0.__module__}.{0.__name__}'.format(sender)
+        handlers.append((post_save, on_trigger, sender, key))
+        if sender is not user_model:
+            # Rows for deleted users are always removed.
+            handlers.append((post_delete, on_trigger, sender, key))
+        if sender._meta.auto_created:
+            handlers.append((m2m_changed, on_m2m_changed, sender, key))
+
+    for signal, handler, sender, key in handlers:
+        signal.connect(
+            handler, sender=sender, weak=False, dispatch_uid='{0}:{1}'.format(uid, key))
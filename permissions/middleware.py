@@ -0,0 +1,59 @@
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+from .exc import PermissionsError
+
+
+class PermissionsMiddleware(MiddlewareMixin):
+
+    """Enforces permissions declared on URL patterns.
+
+    Permissions are declared on URL patterns via
+    :meth:`PermissionsRegistry.url`, :meth:`PermissionsRegistry.path`,
+    or :meth:`PermissionsRegistry.protect`. When a request resolves to
+    one of those patterns, the permissions are checked in
+    ``process_view``, before any view-level code runs. Anonymous users
+    are handed to the unauthenticated handler and other users who lack
+    permission cause :class:`PermissionDenied` to be raised, exactly as
+    with the ``require`` view decorator.
+
+    Requests to views without declared permissions cost a single dict
+    lookup.
+
+    The most convenient way to make use of this is via the
+    ``middleware`` property of an existing registry::
+
+        # my/project/perms.py
+        permissions = PermissionsRegistry()
+        PermissionsMiddleware = permissions.middleware
+
+        # settings.py
+        MIDDLEWARE_CLASSES = [
+            ...
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'my.project.perms.PermissionsMiddleware',
+        ]
+
+    (Use ``MIDDLEWARE`` instead on Django 1.10 and later.)
+
+    It must come after Django's authentication middleware since it
+    needs ``request.user``.
+
+    """
+
+    registry = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        registry = self.registry
+        if registry is None:
+            raise PermissionsError('No permissions registry found')
+        requirements = registry._url_permissions.get(view_func)
+        if requirements is None:
+            return None
+        response = registry._check_url_permissions(requirements, request, view_args, view_kwargs)
+        if response is None:
+            # Tell the callback not to check again.
+            request._permissions_url_authorized = view_func
+        return response
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 02:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedPermission',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(max_length=255)),
+                ('user_id', models.BigIntegerField()),
+                ('object_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='materializedpermission',
+            unique_together=set([('permission', 'user_id', 'object_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='materializedpermission',
+            index_together=set([('permission', 'object_id')]),
+        ),
+    ]
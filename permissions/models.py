@@ -0,0 +1,29 @@
+from django.db import models
+
+
+class MaterializedPermission(models.Model):
+
+    """A precomputed result for a materialized permission.
+
+    A row exists for each ``(permission, user, object)`` combination for
+    which the permission function returned a truthy value. The absence
+    of a row means the permission is *not* granted. Staff, superuser,
+    and anonymous handling isn't stored here; those are still applied
+    at check time.
+
+    User and object IDs are stored as plain integers rather than as
+    foreign keys so that any model with an integer primary key can be
+    materialized.
+
+    """
+
+    permission = models.CharField(max_length=255)
+    user_id = models.BigIntegerField()
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('permission', 'user_id', 'object_id')
+        index_together = ('permission', 'object_id')
+
+    def __str__(self):
+        return '{0.permission}: user {0.user_id}, object {0.object_id}'.format(self)
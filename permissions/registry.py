@@ -1,11 +1,16 @@
 import inspect
 import logging
-from collections import namedtuple
-from functools import wraps
+import threading
+from collections import OrderedDict, namedtuple
+from functools import partial, wraps
+from timeit import default_timer
 
 import django.conf
+from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.core.exceptions import PermissionDenied
+from django.core.signals import request_finished, request_started
+from django.db.models import BooleanField, Model
 from django.http import HttpRequest
 from django.shortcuts import get_object_or_404
 try:
@@ -13,6 +18,14 @@ try:
 except ImportError:
     from django.utils.module_loading import import_by_path as import_string
 
+try:
+    from django.db.models import prefetch_related_objects
+except ImportError:
+    # Django < 1.10
+    from django.db.models.query import prefetch_related_objects as _prefetch_related_objects
+    prefetch_related_objects = lambda instances, *lookups: (
+        _prefetch_related_objects(instances, lookups))
+
 try:
     import rest_framework
 except ImportError:
@@ -20,8 +33,16 @@ except ImportError:
 else:
     from rest_framework.request import Request as DRFRequest
 
+from . import materialize as materialize_
+from .capabilities import get_manifest, make_capabilities_view
+from .context import ContextVar, set_denied_permission
+from .deferred import DeferredPermission
 from .exc import DuplicatePermissionError, NoSuchPermissionError, PermissionsError
+from .fingerprint import get_fingerprint
 from .meta import PermissionsMeta
+from .middleware import PermissionsMiddleware
+from .shadow import Shadow
+from .timeouts import PermissionTimeout, WorkerPool, call_with_statement_timeout
 from .templatetags.permissions import register
 
 
@@ -30,10 +51,26 @@ log = logging.getLogger(__name__)
 
 Entry = namedtuple('Entry', (
     'name', 'perm_func', 'view_decorator', 'model', 'allow_staff', 'allow_superuser',
-    'allow_anonymous', 'unauthenticated_handler', 'request_types', 'views'
+    'allow_anonymous', 'unauthenticated_handler', 'request_types', 'views', 'materialize',
+    'materialize_on', 'models', 'filter_queryset', 'user_prefetch', 'batch', 'expose', 'timeout',
+    'timeout_fallback', 'timeout_thread'
 ))
 
 
+ModelLookup = namedtuple('ModelLookup', ('model', 'arg', 'parent', 'field'))
+ModelLookup.__new__.__defaults__ = (None, 'pk')
+
+
+BootCost = namedtuple('BootCost', ('permissions', 'views', 'seconds'))
+
+
+UrlRequirement = namedtuple('UrlRequirement', ('perm_name', 'field', 'arg', 'view_name'))
+
+
+PermissionState = namedtuple(
+    'PermissionState', ('entry', 'pending', 'wrapped_func', 'filter_func'))
+
+
 NO_VALUE = object()
 
 
@@ -47,9 +84,148 @@ DEFAULT_SETTINGS = {
     # rest_framework.request.Request is always included when DRF is
     # installed.
     'request_types': (),
+
+    'audit_log': None,
+    'lazy': False,
+
+    # Max number of threads used to evaluate each permission
+    # registered with a timeout.
+    'timeout_workers': 10,
 }
 
 
+class PermissionFlagsQuerySetMixin(object):
+
+    """Sets permission flags on model instances as they're fetched.
+
+    Used by :meth:`PermissionsRegistry.annotate` for permissions that
+    can't be checked in the database. Only the rows that are actually
+    fetched (e.g. after the queryset is sliced for a page) are checked,
+    ``chunk_size`` at a time.
+
+    """
+
+    # (registry, user, [(alias, entry), ...], chunk_size)
+    _permission_flags = None
+
+    def _clone(self, *args, **kwargs):
+        clone = super(PermissionFlagsQuerySetMixin, self)._clone(*args, **kwargs)
+        clone._permission_flags = self._permission_flags
+        return clone
+
+    def iterator(self):
+        registry, user, flags, chunk_size = self._permission_flags
+        chunk = []
+        for obj in super(PermissionFlagsQuerySetMixin, self).iterator():
+            if not isinstance(obj, Model):
+                # e.g. values()
+                yield obj
+                continue
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                for obj_ in self._set_flags(registry, user, flags, chunk):
+                    yield obj_
+                chunk = []
+        for obj_ in self._set_flags(registry, user, flags, chunk):
+            yield obj_
+
+    def _set_flags(self, registry, user, flags, instances):
+        for alias, entry in flags:
+            for instance, result in zip(
+                    instances, registry._evaluate_many(entry, user, instances)):
+                setattr(instance, alias, bool(result))
+        return instances
+
+
+_flags_queryset_classes = {}
+
+
+def _with_permission_flags(queryset, registry, user, flags, chunk_size):
+    """Get a copy of ``queryset`` that sets ``flags`` on fetched instances."""
+    base = queryset.__class__
+    klass = _flags_queryset_classes.get(base)
+    if klass is None:
+        klass = type(str(base.__name__), (PermissionFlagsQuerySetMixin, base), {})
+        _flags_queryset_classes[base] = klass
+    queryset = queryset._clone()
+    queryset.__class__ = klass
+    queryset._permission_flags = (registry, user, tuple(flags), chunk_size)
+    return queryset
+
+
+class FrozenTable(object):
+
+    """A compact, read-only mapping of permission names to entries.
+
+    Entries are stored in a tuple and looked up via a name => index
+    dict. This is what a registry's table is replaced with when the
+    registry is frozen.
+
+    """
+
+    __slots__ = ('_index', '_entries')
+
+    def __init__(self, entries):
+        names = sorted(entries)
+        self._index = dict((name, i) for (i, name) in enumerate(names))
+        self._entries = tuple(entries[name] for name in names)
+
+    def __getitem__(self, name):
+        return self._entries[self._index[name]]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, name, default=None):
+        i = self._index.get(name)
+        return default if i is None else self._entries[i]
+
+    def items(self):
+        return [(entry.name, entry) for entry in self._entries]
+
+    def values(self):
+        return list(self._entries)
+
+
+# Serializes changes to the template filters, which are shared by all
+# registries.
+_library_lock = threading.Lock()
+
+
+def _set(mapping, key, value):
+    """Set ``key`` to ``value`` in ``mapping``.
+
+    If ``value`` is ``None``, ``key`` is removed instead.
+
+    """
+    if value is None:
+        mapping.pop(key, None)
+    else:
+        mapping[key] = value
+
+
+def _add_filter(name, filter_func):
+    """Register a template filter.
+
+    The template parser copies the filters with a single
+    ``dict.update()``, which never sees a partial change.
+
+    """
+    filter_func._filter_name = name
+    _set_filter(name, filter_func)
+
+
+def _set_filter(name, filter_func):
+    with _library_lock:
+        _set(register.filters, name, filter_func)
+
+
 def _default(v, default):
     if v is None:
         return default
@@ -93,6 +269,16 @@ class PermissionsRegistry:
               it's not present. Likewise for DRF's request class, except
               that it will only be added if DRF is installed.
 
+        - audit_log: An :class:`permissions.audit.AuditLog` (or dotted
+          path to one) that permission decisions made by view
+          decorators will be recorded to. [None]
+
+        - lazy: Defer building view decorators and wrapped permission
+          functions until a permission is first used, and defer
+          inspecting decorated views until they're first called (or
+          until :meth:`freeze` is called). This speeds up startup in
+          projects with many permissions. [False]
+
         If an option's value isn't passed to the constructor, it will
         be pulled from your project's settings or fall back to the
         defaults noted above in brackets.
@@ -131,11 +317,40 @@ class PermissionsRegistry:
 
     TODO: Write more documentation.
 
+    Thread safety: Checks only look up single keys in the registry's
+    tables (and the template filters), and each change to a table is
+    a single assignment or deletion, so checks never need to take
+    a lock. Nothing iterates over the tables while permissions may be
+    registered. Registrations are serialized by a lock. Tables are
+    updated in place rather than copied, so registering N permissions
+    takes O(N) time.
+
     """
 
     def __init__(self, allow_staff=None, allow_superuser=None, allow_anonymous=None,
-                 unauthenticated_handler=None, request_types=None):
+                 unauthenticated_handler=None, request_types=None, audit_log=None, lazy=None,
+                 timeout_workers=None):
         self._registry = dict()
+        self._pending = dict()
+        self._wrapped_funcs = dict()
+        self._uncompiled = []
+        self._boot_costs = dict()
+        self._build_lock = threading.RLock()
+        self._frozen = False
+        self._overrides = ContextVar('permissions_overrides_{0}'.format(id(self)), default=())
+        self._overrides_active = 0
+        self._url_permissions = dict()
+        self._arg_names = dict()
+        self._shadows = dict()
+        self._timeout_pools = dict()
+        self._timeout_counts = dict()
+        self._timeout_lock = threading.Lock()
+        self._deferred = ContextVar('permissions_deferred_{0}'.format(id(self)), default=None)
+        # Deferred checks that were never read must not outlive the
+        # request (or be resolved in the next one handled by the same
+        # thread).
+        request_started.connect(self._discard_deferred)
+        request_finished.connect(self._discard_deferred)
 
         settings = DEFAULT_SETTINGS.copy()
         if hasattr(django.conf.settings, 'PERMISSIONS'):
@@ -175,6 +390,14 @@ class PermissionsRegistry:
             request_types = (HttpRequest,) + request_types
         self._request_types = request_types
 
+        audit_log = _default(audit_log, settings['audit_log'])
+        if isinstance(audit_log, str):
+            audit_log = import_string(audit_log)
+        self._audit_log = audit_log
+
+        self._lazy = _default(lazy, settings['lazy'])
+        self._timeout_workers = _default(timeout_workers, settings['timeout_workers'])
+
     @property
     def metaclass(self):
         """Get a metaclass configured to use this registry."""
@@ -182,9 +405,34 @@ class PermissionsRegistry:
             self._metaclass = type('PermissionsMeta', (PermissionsMeta,), {'registry': self})
         return self._metaclass
 
+    @property
+    def middleware(self):
+        """Get a middleware class configured to use this registry."""
+        if '_middleware' not in self.__dict__:
+            self._middleware = type(
+                str('PermissionsMiddleware'), (PermissionsMiddleware,), {'registry': self})
+        return self._middleware
+
+    @property
+    def capabilities_view(self):
+        """Get a capability manifest view for this registry.
+
+        See :func:`permissions.capabilities.make_capabilities_view`::
+
+            urlpatterns = [
+                url(r'^capabilities$', permissions.capabilities_view),
+            ]
+
+        """
+        if '_capabilities_view' not in self.__dict__:
+            self._capabilities_view = make_capabilities_view(self)
+        return self._capabilities_view
+
     def register(self, perm_func=None, model=None, allow_staff=None, allow_superuser=None,
                  allow_anonymous=None, unauthenticated_handler=None, request_types=None, name=None,
-                 replace=False, _return_entry=False):
+                 replace=False, materialize=False, materialize_on=None, models=None,
+                 filter_queryset=None, user_prefetch=None, batch=None, expose=False,
+                 timeout=None, timeout_fallback=False, timeout_thread=True, _return_entry=False):
         """Register permission function & return the original function.
 
         This is typically used as a decorator::
@@ -194,6 +442,91 @@ class PermissionsRegistry:
             def can_do_something(user):
                 ...
 
+        Permissions registered with a ``model`` can be materialized by
+        passing ``materialize=True``. The permission function's results
+        will be stored in a table that's kept up to date via model
+        signals, and checks will query that table instead of calling
+        the permission function. ``materialize_on`` is required; it
+        declares which users to recompute when an instance of ``model``
+        is saved, along with any other models (including many-to-many
+        through models) whose changes affect the results; see
+        :func:`permissions.materialize.connect_signals`. Use the
+        ``rebuild_permissions`` management command to populate the
+        table initially.
+
+        Permissions that operate on several related models (e.g., for
+        nested URLs) can pass ``models`` instead of ``model``. Each item
+        is a :class:`ModelLookup` or a tuple of ``(model, arg, parent,
+        field)``, where ``arg`` is the name of the view arg containing
+        the lookup value, ``parent`` is the name of the foreign key to
+        the *previous* model, and ``field`` is the lookup field (``pk``
+        by default)::
+
+            @permissions.register(models=(
+                (Org, 'org_id'),
+                (Project, 'project_id', 'org'),
+                (Widget, 'widget_id', 'project'),
+            ))
+            def can_edit_widget(user, org, project, widget):
+                ...
+
+        Models chained via ``parent`` are loaded in a single query using
+        ``select_related``, which also ensures they belong together; if
+        they don't, a 404 is raised. The instances are passed to the
+        permission function in order.
+
+        ``filter_queryset`` is an optional SQL companion to the
+        permission function for permissions with a ``model``. It takes
+        a user and a queryset and returns the queryset filtered down to
+        the objects the user is permitted; it's used by :meth:`filter`
+        (and things built on it) instead of calling the permission
+        function for each object. It should agree with the permission
+        function, and it needn't handle the staff, superuser, or
+        anonymous options since those are applied first::
+
+            def editable_widgets(user, queryset):
+                return queryset.filter(owner=user)
+
+            @permissions.register(model=Widget, filter_queryset=editable_widgets)
+            def can_edit_widget(user, widget):
+                return widget.owner == user
+
+        ``user_prefetch`` is a list of user relations the permission
+        function accesses, in ``prefetch_related`` form. When the
+        permission is checked for a user, any of those relations that
+        haven't been loaded onto the user yet are loaded and cached, so
+        permission functions share a single load of related data
+        instead of each causing their own queries. When several
+        permissions are checked together (e.g., permissions declared on
+        a URL pattern), the union of their relations is loaded at once::
+
+            @permissions.register(user_prefetch=['groups', 'profile__org'])
+            def can_manage_org(user):
+                ...
+
+        ``batch`` is an optional companion for permissions with a
+        ``model`` that checks many instances at once. It takes a user
+        and a list of instances and returns a list of results in the
+        same order. It's used when checking permissions in bulk (e.g.,
+        by :meth:`iter_permitted`) for permissions that can't be
+        expressed with ``filter_queryset``. Like ``filter_queryset``, it
+        needn't handle the staff, superuser, or anonymous options.
+
+        ``expose`` makes the permission available to clients via the
+        capabilities view (see :meth:`capabilities`). Permissions aren't
+        exposed by default.
+
+        ``timeout`` bounds how long (in seconds) the permission function
+        (or ``batch`` function) may run. When it takes longer, the
+        result is ``timeout_fallback``, which denies permission by
+        default. See :mod:`permissions.timeouts` for how this works and
+        its caveats; in particular, the function is run in a separate
+        thread, so it uses a separate database connection and only sees
+        committed data. Pass ``timeout_thread=False`` to run it in the
+        calling thread instead, with only a statement timeout (on
+        backends that have one) to bound its queries. Timeouts are
+        logged and counted (see :attr:`timeout_counts`).
+
         For internal use only: you can pass ``_return_entry=True`` to
         have the registry :class:`.Entry` returned instead of
         ``perm_func``.
@@ -210,42 +543,199 @@ class PermissionsRegistry:
                 lambda perm_func_:
                     self.register(
                         perm_func_, model, allow_staff, allow_superuser, allow_anonymous,
-                        unauthenticated_handler, request_types, name, replace, _return_entry)
+                        unauthenticated_handler, request_types, name, replace, materialize,
+                        materialize_on, models, filter_queryset, user_prefetch, batch,
+                        expose, timeout, timeout_fallback, timeout_thread, _return_entry)
             )
 
+        start_time = default_timer()
+
         name = _default(name, perm_func.__name__)
-        if name == 'register':
+        if self._frozen:
+            raise PermissionsError('Registry is frozen; cannot register {0}'.format(name))
+        elif name == 'register':
             raise PermissionsError('register cannot be used as a permission name')
-        elif name in self._registry and not replace:
+        elif (name in self._registry or name in self._pending) and not replace:
             raise DuplicatePermissionError(name)
+        elif materialize and model is None:
+            raise PermissionsError('Only permissions with a model can be materialized')
+        elif materialize and model not in (materialize_on or {}):
+            raise PermissionsError(
+                'materialize_on must specify which users to recompute when a {0} is saved'
+                .format(model.__name__))
+        elif filter_queryset is not None and model is None:
+            raise PermissionsError('filter_queryset requires a model')
+        elif batch is not None and model is None:
+            raise PermissionsError('batch requires a model')
+        elif expose and models is not None:
+            raise PermissionsError('Permissions with multiple models cannot be exposed')
+        elif timeout is not None and timeout <= 0:
+            raise PermissionsError('timeout must be greater than 0')
+        elif not timeout_thread and timeout is None:
+            raise PermissionsError('timeout_thread requires a timeout')
+
+        user_prefetch = tuple(user_prefetch or ())
+
+        if models is not None:
+            if model is not None:
+                raise PermissionsError('model and models cannot be used together')
+            models = tuple(
+                m if isinstance(m, ModelLookup) else ModelLookup(*m) for m in models)
+            if not models:
+                raise PermissionsError('models cannot be empty')
+            if models[0].parent is not None:
+                raise PermissionsError('The first model cannot have a parent')
+
+        build = partial(
+            self._build, name, perm_func, model, allow_staff, allow_superuser, allow_anonymous,
+            unauthenticated_handler, request_types, materialize, materialize_on, models,
+            filter_queryset, user_prefetch, batch, expose, timeout, timeout_fallback,
+            timeout_thread)
+
+        if self._lazy and not materialize and not _return_entry:
+            # Materialized permissions are always built immediately so
+            # their signal handlers are connected.
+            with self._build_lock:
+                self._save_state(name)
+                wrapped_func = self._make_lazy_func(name, perm_func)
+                wrapped_func.takes_instance = model is not None or models is not None
+                self._pending[name] = build
+                self._wrapped_funcs.pop(name, None)
+                self._registry.pop(name, None)
+                _add_filter(name, wrapped_func)
+            entry = None
+            log.debug('Registered permission (lazily): {0}'.format(name))
+        else:
+            with self._build_lock:
+                self._save_state(name)
+                entry, wrapped_func = build()
+            log.debug('Registered permission: {0}'.format(name))
+
+        self._record_boot_cost(perm_func.__module__, default_timer() - start_time, permissions=1)
+        return entry if _return_entry else wrapped_func
+
+    __call__ = register
+
+    def _build(self, name, perm_func, model, allow_staff, allow_superuser, allow_anonymous,
+               unauthenticated_handler, request_types, materialize, materialize_on, models,
+               filter_queryset, user_prefetch, batch, expose, timeout, timeout_fallback,
+               timeout_thread):
+        """Create and store the registry entry for a permission.
 
+        Returns the entry along with the wrapped permission function,
+        which is also registered as a template filter.
+
+        """
         view_decorator = self._make_view_decorator(
             name, perm_func, model, allow_staff, allow_superuser, allow_anonymous,
             unauthenticated_handler, request_types)
         entry = Entry(
             name, perm_func, view_decorator, model, allow_staff, allow_superuser, allow_anonymous,
-            unauthenticated_handler, request_types, set())
-        self._registry[name] = entry
+            unauthenticated_handler, request_types, set(), materialize, materialize_on, models,
+            filter_queryset, user_prefetch, batch, expose, timeout, timeout_fallback,
+            timeout_thread)
 
         @wraps(perm_func)
-        def wrapped_func(user, instance=NO_VALUE):
+        def wrapped_func(user, instance=NO_VALUE, *instances):
             if user is None:
                 return False
+            if self._overrides_active:
+                forced = self._get_forced_decision(name)
+                if forced is not None:
+                    return forced
             if not allow_anonymous and user.is_anonymous():
                 return False
-            test = lambda: perm_func(user) if instance is NO_VALUE else perm_func(user, instance)
+
+            def test():
+                if user_prefetch:
+                    self._prefetch_user(user, user_prefetch)
+                if instance is NO_VALUE:
+                    return self._call_perm_func(entry, user)
+                elif instances:
+                    return self._call_perm_func(entry, user, instance, *instances)
+                return self._test_instance(entry, user, instance)
+
             return (
                 allow_staff and user.is_staff or
                 allow_superuser and user.is_superuser or
                 test()
             )
 
-        register.filter(name, wrapped_func)
+        # Used by permissions_fingerprint to decide which args to pass
+        # to template filters.
+        wrapped_func.takes_instance = model is not None or models is not None
 
-        log.debug('Registered permission: {0}'.format(name))
-        return entry if _return_entry else wrapped_func
+        with self._build_lock:
+            # The wrapped function is stored first so it's there for
+            # anyone who finds the entry without taking the lock.
+            self._wrapped_funcs[name] = wrapped_func
+            self._registry[name] = entry
+            self._pending.pop(name, None)
+            _add_filter(name, wrapped_func)
 
-    __call__ = register
+        if materialize:
+            materialize_.connect_signals(self, entry)
+
+        return entry, wrapped_func
+
+    def _make_lazy_func(self, name, perm_func):
+        """Make a stand-in for a lazily-registered permission function.
+
+        The permission is built on first call and the stand-in delegates
+        to the real wrapped function from then on.
+
+        """
+        @wraps(perm_func)
+        def lazy_func(*args, **kwargs):
+            return self._get_wrapped_func(name)(*args, **kwargs)
+
+        return lazy_func
+
+    def _record_boot_cost(self, module, seconds, permissions=0, views=0):
+        with self._build_lock:
+            cost = self._boot_costs.get(module, BootCost(0, 0, 0))
+            self._boot_costs[module] = BootCost(
+                cost.permissions + permissions, cost.views + views, cost.seconds + seconds)
+
+    def freeze(self):
+        """Build all permissions and make the registry immutable.
+
+        This is intended to be called from ``AppConfig.ready()`` once
+        all permissions have been registered. Pending lazy permissions
+        are built and decorated views that haven't been called yet are
+        inspected. The registry's table is then replaced with a compact,
+        read-only structure; any further attempt to register a
+        permission will raise a :class:`PermissionsError`.
+
+        Returns a dict mapping app labels to :class:`BootCost`s, which
+        record how many permissions and decorated views each app has
+        and how much time was spent setting them up. The report is
+        also logged.
+
+        """
+        with self._build_lock:
+            if not self._frozen:
+                for name in list(self._pending):
+                    start_time = default_timer()
+                    perm_func = self._get_entry(name).perm_func
+                    self._record_boot_cost(perm_func.__module__, default_timer() - start_time)
+                for compile_ in self._uncompiled:
+                    compile_()
+                del self._uncompiled[:]
+                self._registry = FrozenTable(self._registry)
+                self._frozen = True
+
+        report = {}
+        for module, cost in self._boot_costs.items():
+            app_config = apps.get_containing_app_config(module)
+            label = app_config.label if app_config is not None else module
+            total = report.get(label, BootCost(0, 0, 0))
+            report[label] = BootCost(*(a + b for (a, b) in zip(total, cost)))
+        for label, cost in sorted(report.items()):
+            log.info(
+                'Permissions boot cost for {0}: {1.permissions} permissions and {1.views} views '
+                'in {2:.2f}ms'.format(label, cost, cost.seconds * 1000))
+        return report
 
     def require(self, perm_name, **kwargs):
         """Use as a decorator on a view to require a permission.
@@ -274,11 +764,21 @@ class PermissionsRegistry:
         return self.require(name)
 
     def _get_entry(self, perm_name):
-        """Get registry entry for permission."""
+        """Get registry entry for permission.
+
+        Lazily-registered permissions are built here on first use.
+
+        """
         try:
             return self._registry[perm_name]
         except KeyError:
-            raise NoSuchPermissionError(perm_name)
+            pass
+        with self._build_lock:
+            if perm_name in self._registry:
+                return self._registry[perm_name]
+            if perm_name in self._pending:
+                return self._pending[perm_name]()[0]
+        raise NoSuchPermissionError(perm_name)
 
     def _get_view_name(self, view):
         """Get fully-qualified name for ``view``."""
@@ -296,7 +796,8 @@ class PermissionsRegistry:
                 raise PermissionsError('Bad call to permissions decorator')
 
             entry = self._get_entry(perm_name)
-            entry.views.add(self._get_view_name(view))
+            view_name = self._get_view_name(view)
+            entry.views.add(view_name)
 
             # When a permission is applied to a class, which is presumed
             # to be a class-based view, instead apply the permission to
@@ -319,16 +820,34 @@ class PermissionsRegistry:
                 view.dispatch = view_decorator(view.dispatch, field)
                 return view
 
-            # This contains the names of all of the view's args
-            # (positional and keyword). This is used to find the field
-            # value for permissions that operate on a model.
-            view_args_spec = inspect.getargspec(view)
-            view_arg_names = view_args_spec.args
-            perm_func_arg_spec = inspect.getargspec(perm_func)
-            perm_func_arg_names = perm_func_arg_spec.args
+            # This will contain the names of all of the view's args
+            # (positional and keyword), which are used to find the field
+            # value for permissions that operate on a model, along with
+            # the names of the perm func's args. For lazy registries,
+            # inspecting the view is deferred until it's first called
+            # (or until the registry is frozen).
+            arg_names = {}
+
+            def compile_():
+                if not arg_names:
+                    start_time = default_timer()
+                    arg_names['view'] = inspect.getargspec(view).args
+                    arg_names['perm_func'] = inspect.getargspec(perm_func).args
+                    self._record_boot_cost(
+                        view.__module__, default_timer() - start_time, views=1)
+
+            if self._lazy and not self._frozen:
+                self._uncompiled.append(compile_)
+            else:
+                compile_()
 
             @wraps(view)
             def wrapper(*args, **kwargs):
+                if not arg_names:
+                    compile_()
+                view_arg_names = arg_names['view']
+                perm_func_arg_names = arg_names['perm_func']
+
                 # The following allows permissions decorators to work on
                 # view functions and class-based view methods. Either
                 # the first or the second arg must be the request. In
@@ -342,73 +861,858 @@ class PermissionsRegistry:
                     raise PermissionsError('Could not find request in args passed to view')
 
                 request = args[request_index]
-                user = request.user
-
-                if not allow_anonymous and user.is_anonymous():
-                    return unauthenticated_handler(request)
-
-                def test():
-                    # All this stuff is in this closure because it won't
-                    # be needed if the permission check is bypassed. In
-                    # particular, we want to avoid fetching the model
-                    # instance if possible.
-                    perm_func_args = [user]
-                    perm_func_kwargs = {}
-
-                    args_index = request_index + 1
-                    remaining_args = args[args_index:]  # Args after request
-                    remaining_arg_names = view_arg_names[args_index:]
 
+                args_index = request_index + 1
+                remaining_args = args[args_index:]  # Args after request
+                remaining_arg_names = view_arg_names[args_index:]
+
+                def get_field_val():
+                    if remaining_args:
+                        # Assume the 1st positional arg after the
+                        # request passed to the view contains the
+                        # field value...
+                        return remaining_args[0]
+                    # ...unless there are no positional args after the
+                    # request; in that case, use the value of the first
+                    # keyword arg.
+                    return kwargs[remaining_arg_names[0]]
+
+                def get_view_args():
                     view_args = kwargs.copy()
                     view_args['request'] = request
                     view_args.update(zip(remaining_arg_names, remaining_args))
+                    return view_args
 
-                    if model is not None:
-                        if remaining_args:
-                            # Assume the 1st positional arg after the
-                            # request passed to the view contains the
-                            # field value...
-                            field_val = remaining_args[0]
-                        else:
-                            # ...unless there are no positional args
-                            # after the request; in that case, use the
-                            # value of the first keyword arg.
-                            field_val = kwargs[remaining_arg_names[0]]
-                        instance = self._get_model_instance(model, **{field: field_val})
-                        perm_func_args.append(instance)
-
-                    # Starting after the perm func's required args
-                    # (either user or user & instance), map view args
-                    # to perm func args.
-                    for n in perm_func_arg_names[len(perm_func_args):]:
-                        if n in view_args:
-                            perm_func_kwargs[n] = view_args[n]
-
-                    return perm_func(*perm_func_args, **perm_func_kwargs)
-
-                has_permission = (
-                    allow_staff and user.is_staff or
-                    allow_superuser and user.is_superuser or
-                    test()
-                )
-
+                has_permission, response = self._authorize(
+                    entry, request, get_field_val, get_view_args, field, view_name,
+                    perm_func_arg_names)
                 if has_permission:
                     return view(*args, **kwargs)
-                elif user.is_anonymous():
-                    return unauthenticated_handler(request)
-                else:
-                    # Tack on the permission name to the request for
-                    # better error handling since Django doesn't
-                    # give you access to the PermissionDenied
-                    # exception object.
-                    request.permission_name = perm_name
-                    raise PermissionDenied(
-                        'The "{0}" permission is required to access this resource'
-                        .format(perm_name))
+                return response
 
             return wrapper
         return view_decorator
 
+    def _authorize(self, entry, request, get_field_val, get_view_args, field, view_name,
+                   perm_func_arg_names):
+        """Decide whether ``request`` may access a view.
+
+        This is shared by view decorators and the URL middleware.
+        ``get_field_val`` and ``get_view_args`` are called only if
+        they're needed; the former returns the lookup value for the
+        permission's model and the latter returns a dict of all the
+        view's args by name (including the request).
+
+        Returns a pair of ``(has_permission, response)``. The response,
+        which comes from the unauthenticated handler, is only relevant
+        when permission is denied to an anonymous user. When permission
+        is denied to any other user, :class:`PermissionDenied` is
+        raised.
+
+        """
+        perm_name = entry.name
+        user = request.user
+        audit_log = self._audit_log
+
+        def get_instance_key():
+            if entry.model is not None:
+                return get_field_val()
+            elif entry.models:
+                view_args = get_view_args()
+                return tuple(view_args.get(m.arg) for m in entry.models)
+            return None
+
+        def audit(allowed):
+            if audit_log is not None and audit_log.should_record(allowed):
+                audit_log.add(perm_name, allowed, user, get_instance_key(), view_name)
+
+        forced = self._get_forced_decision(perm_name) if self._overrides_active else None
+
+        if forced is None and not entry.allow_anonymous and user.is_anonymous():
+            audit(False)
+            return False, entry.unauthenticated_handler(request)
+
+        def test():
+            # All this stuff is in this closure because it won't be
+            # needed if the permission check is bypassed. In particular,
+            # we want to avoid fetching the model instance if possible.
+            perm_func_args = [user]
+            perm_func_kwargs = {}
+            view_args = get_view_args()
+
+            if entry.user_prefetch:
+                self._prefetch_user(user, entry.user_prefetch)
+
+            if entry.model is not None:
+                instance = self._load_model_instance(entry.model, **{field: get_field_val()})
+                perm_func_args.append(instance)
+                if entry.materialize:
+                    return self._test_instance(entry, user, instance)
+            elif entry.models:
+                try:
+                    values = [view_args[m.arg] for m in entry.models]
+                except KeyError as exc:
+                    raise PermissionsError(
+                        'View arg required by {0} not found: {1}'.format(perm_name, exc))
+                perm_func_args.extend(self._load_model_instances(entry.models, values))
+
+            # Starting after the perm func's required args (either user
+            # or user & instance), map view args to perm func args.
+            for n in perm_func_arg_names[len(perm_func_args):]:
+                if n in view_args:
+                    perm_func_kwargs[n] = view_args[n]
+
+            return self._call_perm_func(entry, *perm_func_args, **perm_func_kwargs)
+
+        has_permission = forced if forced is not None else (
+            entry.allow_staff and user.is_staff or
+            entry.allow_superuser and user.is_superuser or
+            test()
+        )
+
+        audit(has_permission)
+
+        if has_permission:
+            return True, None
+        elif user.is_anonymous():
+            return False, entry.unauthenticated_handler(request)
+        else:
+            # Record the permission name for better error handling since
+            # Django doesn't give you access to the PermissionDenied
+            # exception object. See
+            # permissions.context.get_denied_permission().
+            # request.permission_name is deprecated.
+            set_denied_permission(request, perm_name)
+            request.permission_name = perm_name
+            raise PermissionDenied(
+                'The "{0}" permission is required to access this resource'.format(perm_name))
+
+    def protect(self, pattern, perms, field='pk', arg=None):
+        """Declare the permissions required by a URL pattern.
+
+        The permissions are enforced by this registry's
+        :attr:`middleware`, so the view doesn't need to be decorated.
+        Patterns created by :meth:`url` and :meth:`path` also enforce
+        them without the middleware, but patterns passed directly to
+        this method rely on it.
+        ``perms`` is a permission name or a list of them; all of them
+        are required.
+
+        For permissions with a model, ``field`` is the model field to
+        look up by and ``arg`` names the URL kwarg that contains the
+        lookup value. If ``arg`` isn't specified, the first positional
+        URL arg is used, or the URL kwarg if there's only one.
+
+        Returns ``pattern``. :meth:`url` and :meth:`path` are usually
+        more convenient. Unlike those, this applies the permissions to
+        ``pattern``'s view wherever it's used, so it can't be used to
+        apply different permissions to the same view in different
+        patterns.
+
+        """
+        callback = getattr(pattern, 'callback', None)
+        if callback is None:
+            raise PermissionsError('Permissions can only be applied to URL patterns with a view')
+        requirements = self._make_url_requirements(callback, perms, field, arg)
+        with self._build_lock:
+            existing = self._url_permissions.get(callback)
+            if existing is not None and existing != requirements:
+                raise PermissionsError(
+                    'View {0} is already protected by different permissions'
+                    .format(self._get_view_name(callback)))
+            self._url_permissions[callback] = requirements
+        return pattern
+
+    def url(self, regex, view, kwargs=None, name=None, perms=(), field='pk', arg=None):
+        """Wrap ``django.conf.urls.url()``, declaring ``perms``.
+
+        See :meth:`protect`.
+
+        """
+        from django.conf.urls import url
+        view = self._get_url_callback(view)
+        return self.protect(url(regex, view, kwargs, name), perms, field, arg)
+
+    def path(self, route, view, kwargs=None, name=None, perms=(), field='pk', arg=None):
+        """Wrap ``django.urls.path()``, declaring ``perms``.
+
+        This requires Django 2.0 or later. See :meth:`protect`.
+
+        """
+        try:
+            from django.urls import path
+        except ImportError:
+            # Django < 2.0
+            raise PermissionsError('path() requires Django 2.0 or later')
+        view = self._get_url_callback(view)
+        return self.protect(path(route, view, kwargs, name), perms, field, arg)
+
+    def _make_url_requirements(self, callback, perms, field, arg):
+        if isinstance(perms, str):
+            perms = (perms,)
+        view_name = self._get_view_name(callback)
+        requirements = []
+        for perm_name in perms:
+            entry = self._get_entry(perm_name)
+            entry.views.add(view_name)
+            requirements.append(UrlRequirement(perm_name, field, arg, view_name))
+        return tuple(requirements)
+
+    def _get_url_callback(self, view):
+        """Get a distinct callback for ``view`` to use in a URL pattern.
+
+        The middleware only gets the resolved callback, so giving each
+        protected pattern its own lets the same view be used in other
+        patterns with different (or no) permissions.
+
+        The callback also checks the pattern's permissions itself unless
+        the middleware already did, so they're enforced even when the
+        middleware isn't installed.
+
+        """
+        if not callable(view):
+            # e.g. include()
+            raise PermissionsError('Permissions can only be applied to URL patterns with a view')
+
+        @wraps(view)
+        def callback(request, *args, **kwargs):
+            if getattr(request, '_permissions_url_authorized', None) is not callback:
+                requirements = self._url_permissions.get(callback)
+                if requirements is not None:
+                    response = self._check_url_permissions(requirements, request, args, kwargs)
+                    if response is not None:
+                        return response
+            return view(request, *args, **kwargs)
+
+        return callback
+
+    def _check_url_permissions(self, requirements, request, view_args, view_kwargs):
+        """Check the permissions declared on a URL pattern.
+
+        Returns ``None`` if the request is authorized or a response
+        from the unauthenticated handler if it isn't. Raises
+        :class:`PermissionDenied` for other users who lack permission.
+
+        """
+        self._prefetch_for(request.user, [r.perm_name for r in requirements])
+        for requirement in requirements:
+            has_permission, response = self._authorize_url(
+                requirement, request, view_args, view_kwargs)
+            if not has_permission:
+                return response
+        return None
+
+    def _prefetch_for(self, user, perm_names):
+        """Load the union of user relations declared by ``perm_names``."""
+        lookups = set()
+        for name in perm_names:
+            lookups.update(self._get_entry(name).user_prefetch)
+        self._prefetch_user(user, lookups)
+
+    def _authorize_url(self, requirement, request, view_args, view_kwargs):
+        """Authorize a request for a URL with declared permissions."""
+        entry = self._get_entry(requirement.perm_name)
+
+        def get_field_val():
+            if requirement.arg is not None:
+                return view_kwargs[requirement.arg]
+            elif view_args:
+                return view_args[0]
+            elif len(view_kwargs) == 1:
+                return next(iter(view_kwargs.values()))
+            raise PermissionsError(
+                'Could not determine lookup value for {0}; specify arg'.format(entry.name))
+
+        def get_view_args():
+            view_args_ = dict(view_kwargs)
+            view_args_['request'] = request
+            return view_args_
+
+        return self._authorize(
+            entry, request, get_field_val, get_view_args, requirement.field,
+            requirement.view_name, self._get_arg_names(entry.perm_func))
+
+    def _get_arg_names(self, func):
+        """Get the names of ``func``'s args, caching the result."""
+        arg_names = self._arg_names.get(func)
+        if arg_names is None:
+            arg_names = inspect.getargspec(func).args
+            self._arg_names[func] = arg_names
+        return arg_names
+
+    def _test_instance(self, entry, user, instance):
+        """Call the permission function for a model instance.
+
+        For materialized permissions, the stored result is looked up
+        instead.
+
+        """
+        if entry.materialize:
+            return materialize_.has_permission(entry, user, instance)
+        return self._call_perm_func(entry, user, instance)
+
+    def _call_perm_func(self, entry, *args, **kwargs):
+        """Call the permission function for ``entry``.
+
+        If the permission is being shadowed, the call may be sampled
+        for comparison with the candidate (see :meth:`shadow`).
+
+        """
+        perm_func = entry.perm_func
+        if entry.timeout is not None:
+            perm_func = partial(self._call_with_timeout, entry, perm_func, entry.timeout_fallback)
+        shadow = self._shadows.get(entry.name) if self._shadows else None
+        if shadow is not None and shadow.should_sample():
+            return shadow.call(perm_func, args, kwargs)
+        return perm_func(*args, **kwargs)
+
+    def _call_with_timeout(self, entry, func, fallback, *args, **kwargs):
+        """Call ``func`` with ``entry``'s timeout.
+
+        ``func`` is called in a worker thread unless the permission was
+        registered with ``timeout_thread=False``. If the timeout
+        expires, ``fallback`` is returned.
+
+        """
+        if not entry.timeout_thread:
+            call = call_with_statement_timeout
+        else:
+            # Each permission gets its own pool so that one that's
+            # stalled can't use up the workers of the others.
+            key = (entry.name, entry.timeout)
+            pool = self._timeout_pools.get(key)
+            if pool is None:
+                with self._build_lock:
+                    pool = self._timeout_pools.get(key)
+                    if pool is None:
+                        pool = WorkerPool(self._timeout_workers, entry.timeout)
+                        self._timeout_pools[key] = pool
+            call = pool.call
+        try:
+            return call(func, args, kwargs, entry.timeout)
+        except PermissionTimeout:
+            with self._timeout_lock:
+                self._timeout_counts[entry.name] = self._timeout_counts.get(entry.name, 0) + 1
+            log.warning('Permission {0} timed out after {1}s'.format(entry.name, entry.timeout))
+            return fallback
+
+    @property
+    def timeout_counts(self):
+        """Get the number of timeouts for each permission that's had any."""
+        with self._timeout_lock:
+            return dict(self._timeout_counts)
+
+    def filter(self, perm_name, user, queryset):
+        """Filter ``queryset`` down to the objects ``user`` is permitted.
+
+        This respects the ``allow_staff``, ``allow_superuser``, and
+        ``allow_anonymous`` options. If the permission was registered
+        with ``filter_queryset``, that's used to filter in the database.
+        For materialized permissions, the filtering is done in the
+        database via a subquery on the materialized table. Otherwise,
+        the objects in ``queryset`` are loaded and checked (with the
+        permission's ``batch`` function if it has one).
+
+        """
+        entry = self._get_entry(perm_name)
+        if entry.model is None:
+            raise PermissionsError(
+                'Only permissions with a model can be used to filter querysets: {0}'
+                .format(perm_name))
+        if user is None:
+            return queryset.none()
+        if self._overrides_active:
+            forced = self._get_forced_decision(perm_name)
+            if forced is not None:
+                return queryset if forced else queryset.none()
+        if not entry.allow_anonymous and user.is_anonymous():
+            return queryset.none()
+        if entry.allow_staff and user.is_staff or entry.allow_superuser and user.is_superuser:
+            return queryset
+        if entry.filter_queryset is not None:
+            return entry.filter_queryset(user, queryset)
+        if entry.materialize:
+            return queryset.filter(pk__in=materialize_.permitted_ids(entry, user))
+        instances = list(queryset)
+        results = self._evaluate_many(entry, user, instances)
+        return queryset.filter(pk__in=[obj.pk for (obj, r) in zip(instances, results) if r])
+
+    def annotate(self, queryset, user, perm_names, chunk_size=1000):
+        """Annotate ``queryset`` with a boolean for each permission.
+
+        ``perm_names`` can be a list of permission names, in which case
+        each annotation has the same name as its permission, or a dict
+        mapping annotation names to permission names::
+
+            widgets = permissions.annotate(
+                Widget.objects.all(), user, {'can_edit': 'can_edit_widget'})
+
+        Where possible, the results are computed in the database as part
+        of the queryset's query: the staff and superuser bypasses are
+        constants, and permissions registered with ``filter_queryset``
+        and materialized permissions become subqueries. Other
+        permissions are checked in Python as rows are fetched,
+        ``chunk_size`` at a time, and set as attributes on the
+        instances, so slicing the returned queryset (e.g., for
+        pagination) limits how many objects are checked. These
+        attributes aren't part of the query, so they can't be used to
+        filter or order the queryset, and they aren't set by
+        ``values()``.
+
+        This requires Django 1.8 or later.
+
+        """
+        if not isinstance(perm_names, dict):
+            perm_names = OrderedDict((name, name) for name in perm_names)
+        annotations = OrderedDict()
+        flags = []
+        for alias, perm_name in perm_names.items():
+            annotation = self._make_annotation(perm_name, user)
+            if annotation is None:
+                flags.append((alias, self._get_entry(perm_name)))
+            else:
+                annotations[alias] = annotation
+        queryset = queryset.annotate(**annotations)
+        if flags:
+            queryset = _with_permission_flags(queryset, self, user, flags, chunk_size)
+        return queryset
+
+    def _make_annotation(self, perm_name, user):
+        """Make an expression for a permission.
+
+        Returns ``None`` if the permission must be checked in Python.
+
+        """
+        try:
+            from django.db.models import Case, Value, When
+        except ImportError:
+            # Django < 1.8
+            raise PermissionsError('Annotating querysets requires Django 1.8 or later')
+        entry = self._get_entry(perm_name)
+        if entry.model is None:
+            raise PermissionsError(
+                'Only permissions with a model can be annotated: {0}'.format(perm_name))
+        if user is None:
+            return Value(False, output_field=BooleanField())
+        if self._overrides_active:
+            forced = self._get_forced_decision(perm_name)
+            if forced is not None:
+                return Value(forced, output_field=BooleanField())
+        if not entry.allow_anonymous and user.is_anonymous():
+            return Value(False, output_field=BooleanField())
+        if entry.allow_staff and user.is_staff or entry.allow_superuser and user.is_superuser:
+            return Value(True, output_field=BooleanField())
+        if entry.filter_queryset is not None:
+            permitted = entry.filter_queryset(user, entry.model._default_manager.all())
+            permitted = permitted.values('pk')
+        elif entry.materialize:
+            permitted = materialize_.permitted_ids(entry, user)
+        else:
+            return None
+        return Case(
+            When(pk__in=permitted, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField())
+
+    def iter_permitted(self, perm_name, user, queryset, chunk_size=1000):
+        """Iterate over the objects in ``queryset`` ``user`` is permitted.
+
+        This is meant for large result sets, such as exports, that
+        shouldn't be loaded into memory all at once. When the
+        permission can be checked in the database (see :meth:`filter`),
+        the filtered queryset is iterated. Otherwise, the queryset is
+        iterated with ``iterator()`` and objects are checked
+        ``chunk_size`` at a time (using the permission's ``batch``
+        function, if any). Permitted objects are yielded as each chunk
+        is checked, so this works well with ``StreamingHttpResponse``::
+
+            rows = (
+                csv_writer.writerow(widget_row(w))
+                for w in permissions.iter_permitted('can_export_widget', user, widgets))
+            return StreamingHttpResponse(rows, content_type='text/csv')
+
+        """
+        # This isn't a generator itself so that bad permissions are
+        # reported immediately rather than on first iteration.
+        entry = self._get_entry(perm_name)
+        if entry.model is None:
+            raise PermissionsError(
+                'Only permissions with a model can be used to filter querysets: {0}'
+                .format(perm_name))
+        return self._iter_permitted(entry, user, queryset, chunk_size)
+
+    def _iter_permitted(self, entry, user, queryset, chunk_size):
+        if entry.filter_queryset is not None or entry.materialize:
+            for obj in self.filter(entry.name, user, queryset).iterator():
+                yield obj
+            return
+        chunk = []
+        for obj in queryset.iterator():
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                for obj_, permitted in zip(chunk, self._evaluate_many(entry, user, chunk)):
+                    if permitted:
+                        yield obj_
+                chunk = []
+        if chunk:
+            for obj_, permitted in zip(chunk, self._evaluate_many(entry, user, chunk)):
+                if permitted:
+                    yield obj_
+
+    def _evaluate_many(self, entry, user, instances):
+        """Check a permission for many instances of its model.
+
+        Returns a list of booleans in the same order as ``instances``.
+        All of the usual options are respected. The most efficient
+        available method is used: the ``batch`` function, then
+        a single query for materialized permissions or those with
+        a ``filter_queryset`` function, then calling the permission
+        function for each instance.
+
+        """
+        if not instances:
+            return []
+        if user is None:
+            return [False] * len(instances)
+        if self._overrides_active:
+            forced = self._get_forced_decision(entry.name)
+            if forced is not None:
+                return [forced] * len(instances)
+        if not entry.allow_anonymous and user.is_anonymous():
+            return [False] * len(instances)
+        if entry.allow_staff and user.is_staff or entry.allow_superuser and user.is_superuser:
+            return [True] * len(instances)
+        if entry.user_prefetch:
+            self._prefetch_user(user, entry.user_prefetch)
+        if entry.batch is not None:
+            if entry.timeout is not None:
+                fallback = [entry.timeout_fallback] * len(instances)
+                results = self._call_with_timeout(entry, entry.batch, fallback, user, instances)
+            else:
+                results = entry.batch(user, instances)
+            return [bool(r) for r in results]
+        if entry.materialize or entry.filter_queryset is not None:
+            pks = [obj.pk for obj in instances]
+            if entry.materialize:
+                permitted = materialize_.permitted_ids(entry, user).filter(object_id__in=pks)
+            else:
+                queryset = entry.model._default_manager.filter(pk__in=pks)
+                permitted = entry.filter_queryset(user, queryset).values_list('pk', flat=True)
+            permitted = set(permitted)
+            return [obj.pk in permitted for obj in instances]
+        return [bool(self._call_perm_func(entry, user, obj)) for obj in instances]
+
+    def defer(self, perm_name, user, instance=None):
+        """Check a permission later, together with other deferred checks.
+
+        Returns a :class:`permissions.deferred.DeferredPermission`,
+        which is truthy or falsy according to the result of the check.
+        This is useful where checks are scattered through nested code,
+        such as serializers or templates, and can't easily be gathered
+        into a single call to :meth:`filter`::
+
+            can_edit = {w.pk: permissions.defer('can_edit_widget', user, w) for w in widgets}
+            ...
+            if can_edit[widget.pk]:
+                ...
+
+        Pending checks are resolved together when any of them is first
+        read or when :meth:`resolve_deferred` is called. They're grouped
+        by permission and user, and each group is checked as in
+        :meth:`filter`: with a single query if possible, otherwise with
+        the permission's ``batch`` function or one call per instance.
+
+        Pending checks are tracked in a context variable, so they aren't
+        shared between threads. Checks still pending when a request
+        starts or finishes are discarded; reading one of those later
+        checks it by itself.
+
+        """
+        entry = self._get_entry(perm_name)
+        if entry.models:
+            raise PermissionsError(
+                'Permissions registered with multiple models can\'t be deferred: {0}'
+                .format(perm_name))
+        elif (entry.model is None) != (instance is None):
+            raise PermissionsError(
+                'An instance must be passed for {0} if and only if it has a model'
+                .format(perm_name))
+        deferred = DeferredPermission(self, perm_name, user, instance)
+        pending = self._deferred.get()
+        if pending is None:
+            pending = []
+            self._deferred.set(pending)
+        pending.append(deferred)
+        return deferred
+
+    def resolve_deferred(self):
+        """Resolve all pending deferred checks (see :meth:`defer`)."""
+        pending = self._deferred.get()
+        if not pending:
+            return
+        self._deferred.set(None)
+        groups = OrderedDict()
+        for deferred in pending:
+            if not deferred.resolved:
+                key = (deferred.perm_name, id(deferred.user))
+                groups.setdefault(key, []).append(deferred)
+        for group in groups.values():
+            self._resolve_deferred_group(group)
+
+    def _discard_deferred(self, **kwargs):
+        """Discard pending deferred checks in the current context."""
+        if self._deferred.get() is not None:
+            self._deferred.set(None)
+
+    def _resolve_deferred_group(self, group):
+        """Resolve deferred checks that share a permission and user."""
+        first = group[0]
+        entry = self._get_entry(first.perm_name)
+        if entry.model is None:
+            result = self._get_wrapped_func(entry.name)(first.user)
+            for deferred in group:
+                deferred.set_result(result)
+            return
+
+        def key(instance):
+            return id(instance) if instance.pk is None else instance.pk
+
+        # The same instance may be checked more than once.
+        instances = OrderedDict()
+        for deferred in group:
+            instances.setdefault(key(deferred.instance), deferred.instance)
+        results = self._evaluate_many(entry, first.user, list(instances.values()))
+        results = dict(zip(instances, results))
+        for deferred in group:
+            deferred.set_result(results[key(deferred.instance)])
+
+    def _prefetch_user(self, user, lookups):
+        """Load user relations declared by permissions being checked.
+
+        The relations in ``lookups`` that haven't already been loaded
+        are loaded via ``prefetch_related_objects`` and cached on
+        ``user``, so subsequent checks (for the lifetime of the user
+        object, which is typically one request) don't query them again.
+
+        """
+        if not lookups or not isinstance(user, Model) or user.pk is None:
+            return
+        done = getattr(user, '_permissions_prefetched', frozenset())
+        missing = frozenset(lookups).difference(done)
+        if missing:
+            prefetch_related_objects([user], *sorted(missing))
+            user._permissions_prefetched = done.union(missing)
+
+    def shadow(self, perm_name, candidate=None, sample_rate=0.01, background=True, **options):
+        """Compare a replacement permission function with the real one.
+
+        ``candidate`` is run on a sample of calls to the permission
+        function registered as ``perm_name``. The registered function's
+        result is always the one that's used. See
+        :class:`permissions.shadow.Shadow` for the available options.
+
+        This can be used as a decorator::
+
+            @permissions.shadow('can_edit_widget', sample_rate=0.05)
+            def can_edit_widget_v2(user, widget):
+                ...
+
+        Results are collected in a report that's available via
+        :meth:`shadow_report`. Shadowing a permission again replaces its
+        current candidate (and starts a new report).
+
+        Returns ``candidate``.
+
+        """
+        if candidate is None:
+            return lambda candidate: self.shadow(
+                perm_name, candidate, sample_rate, background, **options)
+        self._get_entry(perm_name)
+        shadow = Shadow(perm_name, candidate, sample_rate, background, **options)
+        with self._build_lock:
+            old_shadow = self._shadows.get(perm_name)
+            self._shadows[perm_name] = shadow
+        if old_shadow is not None:
+            old_shadow.close()
+        return candidate
+
+    def shadow_report(self, perm_name, flush=False):
+        """Get the :class:`permissions.shadow.ShadowReport` for a shadowed permission.
+
+        Pass ``flush=True`` to wait for queued comparisons to be run
+        first.
+
+        """
+        shadow = self._shadows.get(perm_name)
+        if shadow is None:
+            raise PermissionsError('Permission is not being shadowed: {0}'.format(perm_name))
+        if flush:
+            shadow.flush()
+        return shadow.report()
+
+    def unshadow(self, perm_name):
+        """Stop shadowing a permission and return its final report."""
+        with self._build_lock:
+            shadow = self._shadows.get(perm_name)
+            if shadow is None:
+                raise PermissionsError('Permission is not being shadowed: {0}'.format(perm_name))
+            self._shadows.pop(perm_name, None)
+        shadow.close()
+        return shadow.report()
+
+    def drf_permission(self, perm_name):
+        """Get a DRF permission class for a permission.
+
+        See :func:`permissions.drf.make_permission_class`.
+
+        """
+        if rest_framework is None:
+            raise PermissionsError('Django REST Framework is not installed')
+        from .drf import make_permission_class
+        return make_permission_class(self, perm_name)
+
+    def drf_filter_backend(self, perm_name):
+        """Get a DRF filter backend class for a permission.
+
+        See :func:`permissions.drf.make_filter_backend`.
+
+        """
+        if rest_framework is None:
+            raise PermissionsError('Django REST Framework is not installed')
+        from .drf import make_filter_backend
+        return make_filter_backend(self, perm_name)
+
+    def capabilities(self, user, perm_names, refs=()):
+        """Get a capability manifest for ``user``.
+
+        ``perm_names`` must all have been registered with
+        ``expose=True``. ``refs`` are object references in the form
+        ``app_label.model_name:pk``. See :mod:`permissions.capabilities`
+        for the format of the manifest.
+
+        """
+        return get_manifest(self, user, perm_names, refs)
+
+    def fingerprint(self, user, perm_names, instance=None):
+        """Get a fingerprint of ``user``'s results for ``perm_names``.
+
+        The fingerprint is a short string that's the same for all users
+        who have the same results for the specified permissions, so it
+        can stand in for the user in cache keys and ETags::
+
+            key = make_template_fragment_key(
+                'widget_actions', [widget.pk, permissions.fingerprint(
+                    user, ['can_edit_widget', 'can_delete_widget'], widget)])
+
+        Permissions with a model are checked against ``instance``, which
+        is required if any are included. The fingerprint doesn't
+        identify the instance, so it should also be included in keys
+        where that matters. See :func:`permissions.fingerprint.get_fingerprint`.
+
+        """
+        funcs = dict((name, self._get_wrapped_func(name)) for name in perm_names)
+        self._prefetch_for(user, funcs)
+        return get_fingerprint(funcs, user, instance)
+
+    def _get_wrapped_func(self, perm_name):
+        """Get the wrapped function for a permission.
+
+        This is the same function returned by :meth:`register` and used
+        as the permission's template filter.
+
+        """
+        wrapped_func = self._wrapped_funcs.get(perm_name)
+        if wrapped_func is None:
+            self._get_entry(perm_name)
+            wrapped_func = self._wrapped_funcs[perm_name]
+        return wrapped_func
+
+    def override(self, allow=(), deny=(), instances=None):
+        """Temporarily force permission decisions; intended for tests.
+
+        ``allow`` and ``deny`` are lists of permission names that will
+        be granted or denied without calling their permission functions
+        or loading model instances (and regardless of the staff,
+        superuser, and anonymous options).
+
+        ``instances`` maps model classes to stub instances to use
+        instead of querying the database when checking permissions that
+        aren't forced. Each value can be an instance or a callable that
+        will be passed the lookup as keyword args (e.g. ``pk=1``).
+
+        Use as a context manager or decorator::
+
+            with permissions.override(allow=['can_edit_widget']):
+                response = self.client.get('/widgets/1/edit')
+
+            @permissions.override(deny=['can_edit_widget'])
+            def test_edit_widget_denied(self):
+                ...
+
+        Permissions (and their template filters) registered or replaced
+        while the override is active are restored when it's exited.
+        Only registrations made in the override's own thread (or task)
+        are restored. When no override is
+        active, checks incur no extra cost beyond testing a counter.
+
+        """
+        from .testing import PermissionsOverride
+        return PermissionsOverride(self, allow, deny, instances)
+
+    def _save_state(self, name):
+        """Save the current state of ``name`` for the active override.
+
+        Only the first change to a permission within an override is
+        saved, so the override can put back what was there before it
+        was entered. Called with the build lock held.
+
+        """
+        stack = self._overrides.get()
+        if stack and name not in stack[-1].saved:
+            stack[-1].saved[name] = PermissionState(
+                self._registry.get(name), self._pending.get(name), self._wrapped_funcs.get(name),
+                register.filters.get(name))
+
+    def _restore_state(self, name, state):
+        """Restore the state of ``name`` saved by :meth:`_save_state`."""
+        with self._build_lock:
+            _set(self._pending, name, state.pending)
+            _set(self._wrapped_funcs, name, state.wrapped_func)
+            _set(self._registry, name, state.entry)
+            _set_filter(name, state.filter_func)
+
+    def _get_forced_decision(self, perm_name):
+        """Get the decision forced by an override, if any."""
+        stack = self._overrides.get()
+        return stack[-1].decisions.get(perm_name) if stack else None
+
+    def _get_override_instance(self, model, kwargs):
+        stack = self._overrides.get()
+        if not stack or model not in stack[-1].instances:
+            return NO_VALUE
+        instance = stack[-1].instances[model]
+        return instance(**kwargs) if callable(instance) else instance
+
+    def _load_model_instance(self, model, **kwargs):
+        if self._overrides_active:
+            instance = self._get_override_instance(model, kwargs)
+            if instance is not NO_VALUE:
+                return instance
+        return self._get_model_instance(model, **kwargs)
+
+    def _load_model_instances(self, lookups, values):
+        if self._overrides_active:
+            instances = [
+                self._get_override_instance(lookup.model, {lookup.field: value})
+                for (lookup, value) in zip(lookups, values)]
+            if NO_VALUE not in instances:
+                return instances
+            return [
+                self._get_model_instance(lookup.model, **{lookup.field: value})
+                if instance is NO_VALUE else instance
+                for (lookup, value, instance) in zip(lookups, values, instances)]
+        return self._get_model_instances(lookups, values)
+
     def entry_for_view(self, view, perm_name):
         """Get registry entry for permission if ``view`` requires it.
 
@@ -433,3 +1737,36 @@ class PermissionsRegistry:
 
     def _get_model_instance(self, model, **kwargs):  # pragma: no cover
         return get_object_or_404(model, **kwargs)
+
+    def _get_model_instances(self, lookups, values):
+        """Load instances for a multi-model permission.
+
+        Each run of lookups that are chained together via ``parent`` is
+        loaded in one query starting from the last model in the run,
+        with ``select_related`` following the parent FKs back to the
+        first. Filtering on all of the lookup values in that query
+        ensures the instances are related as declared.
+
+        """
+        instances = [None] * len(lookups)
+        end = len(lookups) - 1
+        while end >= 0:
+            start = end
+            while lookups[start].parent is not None:
+                start -= 1
+            leaf = lookups[end]
+            filters = {leaf.field: values[end]}
+            path = []
+            for i in range(end, start, -1):
+                path.append(lookups[i].parent)
+                filters['{0}__{1}'.format('__'.join(path), lookups[i - 1].field)] = values[i - 1]
+            queryset = leaf.model._default_manager.all()
+            if path:
+                queryset = queryset.select_related('__'.join(path))
+            instance = get_object_or_404(queryset, **filters)
+            for i in range(end, start - 1, -1):
+                instances[i] = instance
+                if i > start:
+                    instance = getattr(instance, lookups[i].parent)
+            end = start - 1
+        return instances
@@ -0,0 +1,228 @@
+"""Shadow evaluation of replacement permission functions.
+
+A candidate implementation of an existing permission can be registered
+via :meth:`permissions.registry.PermissionsRegistry.shadow`. A sample
+of live calls to the permission function is then also run through the
+candidate. By default, this happens in a background thread so responses
+aren't slowed down. The result of the registered permission function is
+always what's used; the candidate's result is only compared against it.
+
+The latencies of both versions, the number of disagreements, and
+a handful of example disagreements are collected into
+a :class:`ShadowReport` so a rewrite can be promoted (via
+``register(replace=True)``) with some evidence that it's faster and
+gives the same answers.
+
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from timeit import default_timer
+
+from django.db import close_old_connections
+from six.moves import queue
+
+
+log = logging.getLogger(__name__)
+
+
+ShadowReport = namedtuple('ShadowReport', (
+    'permission', 'sampled', 'compared', 'agreed', 'disagreed', 'errors', 'dropped',
+    'primary_latency', 'candidate_latency', 'disagreements'
+))
+
+
+LatencyStats = namedtuple('LatencyStats', ('count', 'mean', 'p50', 'p90', 'p99', 'max'))
+
+
+Disagreement = namedtuple('Disagreement', (
+    'timestamp', 'user_id', 'args', 'primary', 'candidate'
+))
+
+
+_STOP = object()
+
+
+class _Flush(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+def _key(obj):
+    return getattr(obj, 'pk', obj)
+
+
+def _stats(latencies):
+    """Summarize a sequence of latencies (in seconds)."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    if not count:
+        return LatencyStats(0, None, None, None, None, None)
+
+    def percentile(p):
+        return latencies[min(count - 1, int(p * count))]
+
+    return LatencyStats(
+        count, sum(latencies) / count, percentile(0.5), percentile(0.9), percentile(0.99),
+        latencies[-1])
+
+
+class Shadow(object):
+
+    """Runs a candidate permission function alongside the real one.
+
+    Don't create these directly; use
+    :meth:`PermissionsRegistry.shadow` instead.
+
+    Args:
+
+        - permission: Name of the permission being shadowed.
+
+        - candidate: The replacement permission function. It's passed
+          the same args as the registered permission function and must
+          not modify them.
+
+        - sample_rate: Fraction of calls to compare. [0.01]
+
+        - background: Whether to run the candidate in a background
+          thread. When this is off, the candidate is run right after
+          the registered function, in the same thread. [True]
+
+        - max_queue_size: Maximum number of comparisons waiting to be
+          run in the background; samples are dropped (and counted) when
+          the queue is full. [1000]
+
+        - max_samples: Number of recent latencies kept for each version.
+          [10000]
+
+        - max_disagreements: Number of recent disagreements kept as
+          examples. [100]
+
+    """
+
+    def __init__(self, permission, candidate, sample_rate=0.01, background=True,
+                 max_queue_size=1000, max_samples=10000, max_disagreements=100):
+        self.permission = permission
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.background = background
+        self.sampled = 0
+        self.compared = 0
+        self.disagreed = 0
+        self.errors = 0
+        self.dropped = 0
+        self._primary_latencies = deque(maxlen=max_samples)
+        self._candidate_latencies = deque(maxlen=max_samples)
+        self._disagreements = deque(maxlen=max_disagreements)
+        self._queue = queue.Queue(max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def should_sample(self):
+        return not self._closed and random.random() < self.sample_rate
+
+    def call(self, perm_func, args, kwargs):
+        """Call ``perm_func`` and queue a comparison with the candidate.
+
+        The result of ``perm_func`` is returned; exceptions raised by it
+        propagate as usual (and nothing is compared).
+
+        """
+        start_time = default_timer()
+        result = perm_func(*args, **kwargs)
+        elapsed = default_timer() - start_time
+        item = (args, kwargs, result, elapsed)
+        with self._lock:
+            self.sampled += 1
+        if not self.background:
+            self._compare(*item)
+            return result
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+        return result
+
+    def report(self):
+        """Get a :class:`ShadowReport` of the comparisons so far."""
+        with self._lock:
+            return ShadowReport(
+                self.permission, self.sampled, self.compared, self.compared - self.disagreed,
+                self.disagreed, self.errors, self.dropped, _stats(self._primary_latencies),
+                _stats(self._candidate_latencies), list(self._disagreements))
+
+    def flush(self, timeout=None):
+        """Block until queued comparisons have been run.
+
+        Returns ``False`` if they weren't all run in time.
+
+        """
+        if self._thread is None:
+            return True
+        marker = _Flush()
+        self._queue.put(marker, timeout=timeout)
+        return marker.event.wait(timeout)
+
+    def close(self, timeout=None):
+        """Run queued comparisons and stop the worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(
+                    target=self._run, name='permissions-shadow-{0}'.format(self.permission))
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            elif isinstance(item, _Flush):
+                item.event.set()
+            else:
+                close_old_connections()
+                self._compare(*item)
+        close_old_connections()
+
+    def _compare(self, args, kwargs, primary, primary_elapsed):
+        start_time = default_timer()
+        try:
+            candidate = self.candidate(*args, **kwargs)
+        except Exception:
+            log.exception('Shadow of {0} raised an exception'.format(self.permission))
+            with self._lock:
+                self.errors += 1
+            return
+        elapsed = default_timer() - start_time
+        agreed = bool(candidate) == bool(primary)
+        with self._lock:
+            self.compared += 1
+            self._primary_latencies.append(primary_elapsed)
+            self._candidate_latencies.append(elapsed)
+            if not agreed:
+                self.disagreed += 1
+                self._disagreements.append(Disagreement(
+                    time.time(), getattr(args[0], 'pk', None) if args else None,
+                    tuple(_key(a) for a in args[1:]), bool(primary), bool(candidate)))
+        if not agreed:
+            log.warning(
+                'Shadow of {0} disagreed: registered={1} candidate={2}'.format(
+                    self.permission, bool(primary), bool(candidate)))
@@ -1,4 +1,42 @@
+import django
 from django import template
 
+from ..exc import NoSuchPermissionError
+from ..fingerprint import get_fingerprint
+
 
 register = template.Library()
+
+
+if django.VERSION[:2] < (1, 9):
+    # simple_tag doesn't support "as" before Django 1.9
+    _fingerprint_tag = register.assignment_tag
+else:
+    _fingerprint_tag = register.simple_tag
+
+
+@_fingerprint_tag
+def permissions_fingerprint(user, *perm_names, **kwargs):
+    """Get a fingerprint of ``user``'s results for ``perm_names``.
+
+    This is meant for use in fragment cache keys so that users with the
+    same permissions share cached content::
+
+        {% permissions_fingerprint user 'can_edit' 'can_delete' instance=widget as fp %}
+        {% cache 600 widget_actions widget.pk fp %}
+            ...
+        {% endcache %}
+
+    Before Django 1.9, the result must be assigned with ``as``.
+
+    See :meth:`permissions.registry.PermissionsRegistry.fingerprint`.
+
+    """
+    instance = kwargs.pop('instance', None)
+    funcs = {}
+    for name in perm_names:
+        try:
+            funcs[name] = register.filters[name]
+        except KeyError:
+            raise NoSuchPermissionError(name)
+    return get_fingerprint(funcs, user, instance)
@@ -0,0 +1,94 @@
+"""Test helpers.
+
+See :meth:`permissions.registry.PermissionsRegistry.override`.
+
+"""
+from collections import namedtuple
+from functools import wraps
+
+
+OverrideFrame = namedtuple('OverrideFrame', ('override', 'decisions', 'instances', 'saved'))
+
+
+class PermissionsOverride(object):
+
+    """Temporarily force permission decisions and stub model instances.
+
+    Don't create these directly; use
+    :meth:`PermissionsRegistry.override` instead. An override can be
+    used as a context manager, as a function decorator, or as a class
+    decorator on a ``TestCase`` (in which case it's applied around each
+    test, including ``setUp`` and ``tearDown``).
+
+    Overrides are tracked in a context variable, so tests running in
+    parallel threads don't see each other's overrides. They can be
+    nested; inner overrides take precedence.
+
+    When an override is exited, permissions registered (or replaced)
+    within it, along with their template filters, are restored to what
+    they were when it was entered, so they don't leak into other tests.
+    Only those permissions are touched, so registrations made by other
+    threads in the meantime are kept.
+
+    """
+
+    def __init__(self, registry, allow=(), deny=(), instances=None):
+        self.registry = registry
+        self.decisions = dict((name, True) for name in allow)
+        self.decisions.update((name, False) for name in deny)
+        self.instances = instances or {}
+
+    def enable(self):
+        registry = self.registry
+        for name in self.decisions:
+            registry._get_entry(name)
+        stack = registry._overrides.get()
+        decisions, instances = {}, {}
+        if stack:
+            decisions.update(stack[-1].decisions)
+            instances.update(stack[-1].instances)
+        decisions.update(self.decisions)
+        instances.update(self.instances)
+        # The registry records the prior state of permissions
+        # registered while this is the innermost override in saved.
+        registry._overrides.set(stack + (OverrideFrame(self, decisions, instances, {}),))
+        with registry._build_lock:
+            registry._overrides_active += 1
+
+    def disable(self):
+        registry = self.registry
+        stack = registry._overrides.get()
+        if not stack or stack[-1].override is not self:
+            raise RuntimeError('Permissions overrides must be exited in reverse order')
+        frame = stack[-1]
+        registry._overrides.set(stack[:-1])
+        with registry._build_lock:
+            registry._overrides_active -= 1
+            for name, state in frame.saved.items():
+                registry._restore_state(name, state)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def __call__(self, obj):
+        if isinstance(obj, type):
+            set_up = obj.setUp
+
+            def setUp(test_case):
+                self.enable()
+                test_case.addCleanup(self.disable)
+                set_up(test_case)
+
+            obj.setUp = setUp
+            return obj
+
+        @wraps(obj)
+        def wrapper(*args, **kwargs):
+            with self:
+                return obj(*args, **kwargs)
+
+        return wrapper
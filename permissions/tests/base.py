@@ -14,6 +14,9 @@ class PermissionsRegistry(BasePermissionsRegistry):
     def _get_model_instance(self, model, **kwargs):
         return model(**kwargs)
 
+    def _get_model_instances(self, lookups, values):
+        return [lookup.model(**{lookup.field: v}) for (lookup, v) in zip(lookups, values)]
+
 
 class Model(object):
 
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import models
+
+
+class Widget(models.Model):
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    is_public = models.BooleanField(default=False)
+
+
+class Org(models.Model):
+
+    name = models.CharField(max_length=255)
+
+
+class Project(models.Model):
+
+    org = models.ForeignKey(Org, on_delete=models.CASCADE)
+
+
+class Part(models.Model):
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.core.exceptions import PermissionDenied
+
+from .. import audit
+from ..audit import AuditLog, JSONLinesSink
+
+from .base import Model, PermissionsRegistry, TestCase, User
+
+
+class ListSink(object):
+
+    def __init__(self):
+        self.records = []
+        self.closed = False
+
+    def write(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        self.closed = True
+
+
+class BlockingSink(ListSink):
+
+    def __init__(self):
+        super(BlockingSink, self).__init__()
+        self.event = threading.Event()
+
+    def write(self, records):
+        self.event.wait()
+        super(BlockingSink, self).write(records)
+
+
+class TestAudit(TestCase):
+
+    def setUp(self):
+        super(TestAudit, self).setUp()
+        self.sink = ListSink()
+        self.audit_log = AuditLog(self.sink, batch_size=10, flush_interval=0.01)
+        self.registry = PermissionsRegistry(audit_log=self.audit_log)
+
+        @self.registry.register(model=Model)
+        def can_view(user, instance):
+            return user.can_view
+
+        @self.registry.require('can_view', field='model_id')
+        def view(request, model_id):
+            pass
+
+        self.view = view
+
+    def tearDown(self):
+        self.audit_log.close()
+
+    def _call_view(self, can_view):
+        request = self.request_factory.get('/things/1')
+        request.user = User(pk=7, can_view=can_view)
+        self.view(request, 1)
+
+    def test_denial_is_recorded(self):
+        self.assertRaises(PermissionDenied, self._call_view, False)
+        self.audit_log.close()
+        self.assertTrue(self.sink.closed)
+        self.assertEqual(len(self.sink.records), 1)
+        record = self.sink.records[0]
+        self.assertEqual(record.permission, 'can_view')
+        self.assertFalse(record.allowed)
+        self.assertEqual(record.user_id, 7)
+        self.assertEqual(record.instance_key, 1)
+        self.assertIn(record.view, self.registry._get_entry('can_view').views)
+
+    def test_old_connections_are_closed_around_writes(self):
+        calls = []
+        close_old_connections = audit.close_old_connections
+        audit.close_old_connections = lambda: calls.append(threading.current_thread().name)
+        try:
+            self.assertRaises(PermissionDenied, self._call_view, False)
+            self.audit_log.flush()
+        finally:
+            audit.close_old_connections = close_old_connections
+        self.assertEqual(calls, ['permissions-audit'] * 2)
+
+    def test_allows_are_sampled(self):
+        self._call_view(True)
+        self.audit_log.flush()
+        self.assertEqual(self.sink.records, [])
+        self.audit_log.sample_rate = 1.0
+        self._call_view(True)
+        self.audit_log.flush()
+        self.assertEqual(len(self.sink.records), 1)
+        self.assertTrue(self.sink.records[0].allowed)
+
+    def test_records_are_dropped_when_queue_is_full(self):
+        sink = BlockingSink()
+        audit_log = AuditLog(sink, batch_size=1, max_queue_size=2)
+        for _ in range(10):
+            audit_log.record('perm', False)
+        self.assertGreater(audit_log.dropped, 0)
+        sink.event.set()
+        audit_log.close()
+        self.assertEqual(audit_log.recorded + audit_log.dropped, 10)
+        self.assertEqual(audit_log.written, audit_log.recorded)
+        self.assertEqual(len(sink.records), audit_log.written)
+
+    def test_json_lines_sink(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'audit.jsonl')
+            audit_log = AuditLog(JSONLinesSink(path))
+            audit_log.record('perm', False, User(pk=1), 'key', 'view')
+            audit_log.close()
+            with open(path) as fp:
+                lines = [json.loads(line) for line in fp]
+            self.assertEqual(len(lines), 1)
+            self.assertEqual(lines[0]['permission'], 'perm')
+            self.assertEqual(lines[0]['instance_key'], 'key')
+        finally:
+            shutil.rmtree(directory)
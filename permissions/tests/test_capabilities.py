@@ -0,0 +1,138 @@
+import json
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import RequestFactory, TestCase
+
+from permissions import PermissionsRegistry
+from permissions.capabilities import get_manifest
+from permissions.exc import PermissionsError
+
+from .models import Org, Project
+
+
+class TestCapabilities(TestCase):
+
+    def setUp(self):
+        self.registry = PermissionsRegistry()
+
+        @self.registry.register(expose=True)
+        def can_create_org(user):
+            return user.is_active
+
+        def batch(user, orgs):
+            self.batches.append(len(orgs))
+            return [org.name == user.username for org in orgs]
+
+        @self.registry.register(model=Org, batch=batch, expose=True)
+        def can_edit_org(user, org):
+            raise AssertionError('batch should be used instead')
+
+        @self.registry.register(model=Org, allow_anonymous=True, expose=True)
+        def can_view_org(user, org):
+            return True
+
+        @self.registry.register(model=Project, expose=True)
+        def can_edit_project(user, project):
+            return project.org.name == user.username
+
+        @self.registry.register
+        def is_secret(user):
+            return True
+
+        self.batches = []
+        self.user = User.objects.create(username='user')
+        self.org = Org.objects.create(name='user')
+        self.other_org = Org.objects.create(name='other')
+        self.project = Project.objects.create(org=self.org)
+        self.factory = RequestFactory()
+        self.view = self.registry.capabilities_view
+
+    def _ref(self, obj):
+        return '{0._meta.app_label}.{0._meta.model_name}:{0.pk}'.format(obj)
+
+    def _get(self, perms, objects, user=None, **extra):
+        request = self.factory.get(
+            '/capabilities', {'perms': ','.join(perms), 'objects': ','.join(objects)}, **extra)
+        request.user = user or self.user
+        return self.view(request)
+
+    def test_manifest(self):
+        perms = ['can_create_org', 'can_edit_org', 'can_view_org', 'can_edit_project']
+        org, other_org, project = (
+            self._ref(self.org), self._ref(self.other_org), self._ref(self.project))
+        manifest = self.registry.capabilities(
+            self.user, perms, [org, other_org, project, 'tests.org:0'])
+        self.assertEqual(manifest, {
+            'permissions': perms,
+            'user': 0b0001,
+            'objects': {
+                org: 0b0110,
+                other_org: 0b0100,
+                project: 0b1000,
+                'tests.org:0': 0,
+            },
+        })
+        self.assertEqual(self.batches, [2])
+
+    def test_anonymous_user(self):
+        manifest = self.registry.capabilities(
+            AnonymousUser(), ['can_edit_org', 'can_view_org'], [self._ref(self.org)])
+        self.assertEqual(manifest['objects'], {self._ref(self.org): 0b10})
+
+    def test_unexposed_permissions_are_rejected(self):
+        for perms in (['is_secret'], ['no_such_permission']):
+            self.assertRaises(PermissionsError, self.registry.capabilities, self.user, perms)
+            response = self._get(perms, [])
+            self.assertEqual(response.status_code, 400)
+
+    def test_bad_refs_are_rejected(self):
+        for ref in ('tests.org', 'tests.nope:1', 'tests.org:x', 'org:1'):
+            response = self._get(['can_edit_org'], [ref])
+            self.assertEqual(response.status_code, 400)
+
+    def test_unrelated_models_are_rejected_without_querying(self):
+        for perms in (['can_edit_org'], ['can_create_org']):
+            with self.assertNumQueries(0):
+                response = self._get(perms, ['auth.user:1', self._ref(self.org)])
+            self.assertEqual(response.status_code, 400)
+
+    def test_limits(self):
+        refs = ['tests.org:{0}'.format(i) for i in range(1, 4)]
+        self.assertRaises(
+            PermissionsError, get_manifest, self.registry, self.user, ['can_edit_org'], refs,
+            max_objects=2)
+        self.assertRaises(
+            PermissionsError, get_manifest, self.registry, self.user,
+            ['can_edit_org', 'can_view_org'], refs, max_permissions=1)
+        manifest = get_manifest(
+            self.registry, self.user, ['can_edit_org'], refs, max_permissions=1, max_objects=3)
+        self.assertEqual(len(manifest['objects']), 3)
+        response = self._get(['can_edit_org'], refs * 400)
+        self.assertEqual(response.status_code, 400)
+
+    def test_view(self):
+        response = self._get(['can_edit_org'], [self._ref(self.org)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            'permissions': ['can_edit_org'],
+            'user': 0,
+            'objects': {self._ref(self.org): 1},
+        })
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_etag(self):
+        args = (['can_edit_org'], [self._ref(self.org)])
+        etag = self._get(*args)['ETag']
+        response = self._get(*args, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        other_user = User.objects.create(username='other')
+        response = self._get(*args, user=other_user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_expose_cannot_be_used_with_models(self):
+        with self.assertRaises(PermissionsError):
+            self.registry.register(
+                lambda user, org, project: True, name='perm', expose=True,
+                models=[(Org, 'org_id'), (Project, 'project_id', 'org')])
@@ -0,0 +1,111 @@
+import threading
+from unittest import skipIf
+
+from django.core.exceptions import PermissionDenied
+from django.template import Context, Template
+
+from ..context import get_denied_permission
+
+from .base import TestCase, User
+
+try:
+    import asyncio
+    import contextvars
+except ImportError:
+    asyncio = contextvars = None
+
+
+class TestContext(TestCase):
+
+    def setUp(self):
+        super(TestContext, self).setUp()
+        for name in ('perm_a', 'perm_b'):
+            self.registry.register(lambda user: user.allowed, name=name)
+
+    def _view(self, perm_name):
+
+        @self.registry.require(perm_name)
+        def view(request):
+            return 'ok'
+
+        return view
+
+    def _request(self, allowed):
+        request = self.request_factory.get('/things')
+        request.user = User(allowed=allowed)
+        return request
+
+    def test_denied_permission_is_bound_to_request(self):
+        request = self._request(False)
+        self.assertRaises(PermissionDenied, self._view('perm_a'), request)
+        self.assertEqual(get_denied_permission(request), 'perm_a')
+        self.assertIsNone(get_denied_permission(self._request(False)))
+
+    def test_concurrent_checks_while_registering(self):
+        errors = []
+        stop = threading.Event()
+        view = self._view('perm_a')
+        source = '{% load permissions %}{% if user|perm_a %}yes{% endif %}'
+
+        def check():
+            try:
+                while not stop.is_set():
+                    self.assertEqual(view(self._request(True)), 'ok')
+                    self.assertTrue(self.registry._get_wrapped_func('perm_a')(User(allowed=True)))
+                    Template(source).render(Context({'user': User(allowed=True)}))
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=check) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        try:
+            for i in range(500):
+                self.registry.register(
+                    lambda user: user.allowed, name='perm_a', replace=True)
+                self.registry.register(lambda user: True, name='perm_{0}'.format(i))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+
+    @skipIf(contextvars is None, 'contextvars is not available')
+    def test_coroutines_have_separate_state(self):
+        test_case = self
+
+        class Check(object):
+
+            def __init__(self, perm_name):
+                self.perm_name = perm_name
+                self.denied = None
+
+            def __await__(self):
+                request = test_case._request(False)
+                with test_case.registry.override(deny=[self.perm_name]):
+                    try:
+                        test_case._view(self.perm_name)(request)
+                    except PermissionDenied:
+                        pass
+                    # Let the other tasks run before reading the state
+                    # set above.
+                    yield
+                    self.denied = get_denied_permission(request)
+                    self.forced = test_case.registry._get_forced_decision(self.perm_name)
+                    self.other_forced = test_case.registry._get_forced_decision(
+                        'perm_b' if self.perm_name == 'perm_a' else 'perm_a')
+
+        checks = [Check('perm_a' if i % 2 else 'perm_b') for i in range(20)]
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(asyncio.gather(*checks))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        for check in checks:
+            self.assertEqual(check.denied, check.perm_name)
+            self.assertFalse(check.forced)
+            self.assertIsNone(check.other_forced)
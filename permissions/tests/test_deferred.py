@@ -0,0 +1,99 @@
+import threading
+
+from django.contrib.auth.models import User as AuthUser
+from django.core.signals import request_finished, request_started
+from django.test import TestCase
+
+from permissions import PermissionsRegistry
+from permissions.exc import PermissionsError
+
+from .models import Org
+
+
+class TestDeferred(TestCase):
+
+    def setUp(self):
+        self.registry = PermissionsRegistry()
+        self.batches = []
+
+        def batch(user, orgs):
+            self.batches.append([org.name for org in orgs])
+            return [org.name == user.username for org in orgs]
+
+        @self.registry.register(model=Org, batch=batch)
+        def can_edit_org(user, org):
+            raise AssertionError('batch should be used instead')
+
+        def filter_orgs(user, queryset):
+            return queryset.filter(name=user.username)
+
+        @self.registry.register(model=Org, filter_queryset=filter_orgs)
+        def can_view_org(user, org):
+            raise AssertionError('filter_queryset should be used instead')
+
+        @self.registry.register
+        def is_active(user):
+            self.batches.append(user.username)
+            return user.is_active
+
+        self.user = AuthUser.objects.create(username='user')
+        self.other_user = AuthUser.objects.create(username='other')
+        self.org = Org.objects.create(name='user')
+        self.other_org = Org.objects.create(name='other')
+
+    def test_checks_are_resolved_together_on_first_read(self):
+        can_edit = self.registry.defer('can_edit_org', self.user, self.org)
+        cannot_edit = self.registry.defer('can_edit_org', self.user, self.other_org)
+        self.assertEqual(self.batches, [])
+        self.assertTrue(can_edit)
+        self.assertEqual(self.batches, [['user', 'other']])
+        self.assertFalse(cannot_edit)
+        self.assertEqual(len(self.batches), 1)
+
+    def test_checks_are_grouped_by_permission_and_user(self):
+        checks = [
+            self.registry.defer('can_edit_org', self.user, self.org),
+            self.registry.defer('can_edit_org', self.other_user, self.org),
+            self.registry.defer('can_edit_org', self.user, self.other_org),
+            self.registry.defer('can_view_org', self.other_user, self.other_org),
+            self.registry.defer('is_active', self.user),
+            self.registry.defer('is_active', self.user),
+        ]
+        with self.assertNumQueries(1):
+            self.registry.resolve_deferred()
+        self.assertEqual(self.batches, [['user', 'other'], ['user'], 'user'])
+        self.assertEqual([bool(c) for c in checks], [True, False, False, True, True, True])
+
+    def test_duplicate_instances_are_checked_once(self):
+        first = self.registry.defer('can_edit_org', self.user, self.org)
+        second = self.registry.defer('can_edit_org', self.user, Org.objects.get(pk=self.org.pk))
+        self.assertTrue(first)
+        self.assertTrue(second)
+        self.assertEqual(self.batches, [['user']])
+
+    def test_checks_are_per_thread(self):
+        check = self.registry.defer('can_edit_org', self.user, self.org)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            bool(self.registry.defer('can_edit_org', self.user, self.other_org))))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [False])
+        self.assertEqual(self.batches, [['other']])
+        self.assertTrue(check)
+        self.assertEqual(self.batches, [['other'], ['user']])
+
+    def test_pending_checks_are_discarded_between_requests(self):
+        for signal in (request_finished, request_started):
+            del self.batches[:]
+            unread = self.registry.defer('can_edit_org', self.other_user, self.org)
+            signal.send(sender=None)
+            self.assertFalse(self.registry.defer('can_edit_org', self.user, self.other_org))
+            self.assertEqual(self.batches, [['other']])
+            self.assertFalse(unread)
+            self.assertEqual(self.batches, [['other'], ['user']])
+
+    def test_instance_is_required_for_model_permissions(self):
+        self.assertRaises(PermissionsError, self.registry.defer, 'can_edit_org', self.user)
+        self.assertRaises(
+            PermissionsError, self.registry.defer, 'is_active', self.user, self.org)
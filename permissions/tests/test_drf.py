@@ -0,0 +1,81 @@
+from unittest import skipIf
+
+from django.contrib.auth.models import User
+
+from permissions import PermissionsRegistry
+from permissions.exc import PermissionsError
+
+from .base import TestCase
+from .models import Org
+
+try:
+    import rest_framework
+except ImportError:
+    rest_framework = None
+else:
+    from rest_framework import generics, serializers
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    class OrgSerializer(serializers.ModelSerializer):
+
+        class Meta:
+            model = Org
+            fields = ('id', 'name')
+
+
+@skipIf(rest_framework is None, 'Django REST Framework is not installed')
+class TestDRF(TestCase):
+
+    def setUp(self):
+        super(TestDRF, self).setUp()
+        self.registry = PermissionsRegistry()
+        self.user = User.objects.create(username='user')
+        self.org = Org.objects.create(name='user')
+        self.other_org = Org.objects.create(name='other')
+
+        def filter_orgs(user, queryset):
+            return queryset.filter(name=user.username)
+
+        @self.registry.register(model=Org, filter_queryset=filter_orgs)
+        def can_view_org(user, org):
+            return org.name == user.username
+
+        @self.registry.register
+        def is_staff(user):
+            return user.is_staff
+
+        self.factory = APIRequestFactory()
+
+    def _get(self, view, **kwargs):
+        request = self.factory.get('/things')
+        force_authenticate(request, user=self.user)
+        return view(request, **kwargs)
+
+    def test_detail_permission_reuses_object(self):
+        view = generics.RetrieveAPIView.as_view(
+            queryset=Org.objects.all(), serializer_class=OrgSerializer,
+            permission_classes=[self.registry.drf_permission('can_view_org')])
+        with self.assertNumQueries(1):
+            response = self._get(view, pk=self.org.pk)
+        self.assertEqual(response.status_code, 200)
+        response = self._get(view, pk=self.other_org.pk)
+        self.assertEqual(response.status_code, 403)
+
+    def test_permission_without_model(self):
+        view = generics.ListAPIView.as_view(
+            queryset=Org.objects.all(), serializer_class=OrgSerializer,
+            permission_classes=[self.registry.drf_permission('is_staff')])
+        self.assertEqual(self._get(view).status_code, 403)
+        self.user.is_staff = True
+        self.assertEqual(self._get(view).status_code, 200)
+
+    def test_filter_backend(self):
+        view = generics.ListAPIView.as_view(
+            queryset=Org.objects.all(), serializer_class=OrgSerializer,
+            filter_backends=[self.registry.drf_filter_backend('can_view_org')])
+        with self.assertNumQueries(1):
+            response = self._get(view)
+        self.assertEqual([o['id'] for o in response.data], [self.org.pk])
+
+    def test_filter_backend_requires_model(self):
+        self.assertRaises(PermissionsError, self.registry.drf_filter_backend, 'is_staff')
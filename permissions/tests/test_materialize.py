@@ -0,0 +1,146 @@
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+import six
+
+from permissions import PermissionsRegistry, materialize
+from permissions.exc import PermissionsError
+from permissions.models import MaterializedPermission
+
+from .models import Widget
+
+
+registry = PermissionsRegistry()
+
+
+checked_users = []
+
+
+@registry.register(
+    model=Widget, materialize=True, materialize_on={Widget: lambda w: ([w.owner_id], [w])})
+def can_edit_widget(user, widget):
+    checked_users.append(user.pk)
+    return widget.owner_id == user.pk
+
+
+@registry.register(
+    model=Widget, materialize=True, materialize_on={Widget: lambda w: ([w.owner_id], [w])})
+def can_delete_widget(user, widget):
+    return widget.owner_id == user.pk
+
+
+@registry.register(
+    model=Widget, materialize=True, materialize_on={
+        Widget: lambda w: (User.objects.filter(groups__name='viewers'), [w]),
+        User.groups.through: lambda row: ([row.user_id], None),
+    })
+def can_view_widget(user, widget):
+    return user.groups.filter(name='viewers').exists()
+
+
+class TestMaterialize(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.other = User.objects.create(username='other')
+        self.widget = Widget.objects.create(owner=self.owner)
+
+    def _rows(self, permission='can_edit_widget'):
+        return set(
+            MaterializedPermission.objects
+            .filter(permission=permission)
+            .values_list('user_id', 'object_id'))
+
+    def test_save_updates_table(self):
+        self.assertEqual(self._rows(), {(self.owner.pk, self.widget.pk)})
+        self.widget.owner = self.other
+        self.widget.save()
+        self.assertEqual(self._rows(), {(self.other.pk, self.widget.pk)})
+
+    def test_save_only_checks_declared_users_and_holders(self):
+        User.objects.create(username='bystander')
+        del checked_users[:]
+        self.widget.owner = self.other
+        self.widget.save()
+        self.assertEqual(sorted(checked_users), sorted([self.owner.pk, self.other.pk]))
+
+    def test_m2m_changes_update_table(self):
+        group = Group.objects.create(name='viewers')
+        self.other.groups.add(group)
+        self.assertEqual(self._rows('can_view_widget'), {(self.other.pk, self.widget.pk)})
+        group.user_set.remove(self.other)
+        self.assertEqual(self._rows('can_view_widget'), set())
+        group.user_set.add(self.owner, self.other)
+        self.assertEqual(len(self._rows('can_view_widget')), 2)
+        self.other.groups.clear()
+        self.assertEqual(self._rows('can_view_widget'), {(self.owner.pk, self.widget.pk)})
+
+    def test_delete_updates_table(self):
+        self.widget.delete()
+        self.assertEqual(self._rows(), set())
+
+    def test_check_uses_table(self):
+        self.assertTrue(can_edit_widget(self.owner, self.widget))
+        self.assertFalse(can_edit_widget(self.other, self.widget))
+        MaterializedPermission.objects.all().delete()
+        self.assertFalse(can_edit_widget(self.owner, self.widget))
+
+    def test_filter(self):
+        other_widget = Widget.objects.create(owner=self.other)
+        queryset = registry.filter('can_edit_widget', self.owner, Widget.objects.all())
+        self.assertEqual(list(queryset), [self.widget])
+        queryset = registry.filter('can_edit_widget', self.other, Widget.objects.all())
+        self.assertEqual(list(queryset), [other_widget])
+
+    def test_rebuild_and_verify(self):
+        Widget.objects.create(owner=self.other)
+        expected = self._rows()
+        MaterializedPermission.objects.all().delete()
+
+        stderr = six.StringIO()
+        with self.assertRaises(CommandError):
+            call_command(
+                'rebuild_permissions', 'permissions.tests.test_materialize.registry',
+                verify=True, processes=0, stdout=six.StringIO(), stderr=stderr)
+        self.assertIn('2 missing rows', stderr.getvalue())
+
+        call_command(
+            'rebuild_permissions', 'permissions.tests.test_materialize.registry',
+            processes=0, chunk_size=1, stdout=six.StringIO())
+        self.assertEqual(self._rows(), expected)
+        call_command(
+            'rebuild_permissions', 'permissions.tests.test_materialize.registry',
+            verify=True, processes=0, stdout=six.StringIO())
+
+    def test_rebuild_named_permissions(self):
+        expected = self._rows()
+        MaterializedPermission.objects.all().delete()
+        call_command(
+            'rebuild_permissions', 'permissions.tests.test_materialize.registry',
+            'can_edit_widget', 'can_delete_widget', processes=0, stdout=six.StringIO())
+        self.assertEqual(self._rows(), expected)
+        self.assertEqual(self._rows('can_delete_widget'), expected)
+
+        MaterializedPermission.objects.all().delete()
+        call_command(
+            'rebuild_permissions', 'permissions.tests.test_materialize.registry',
+            'can_delete_widget', processes=0, stdout=six.StringIO())
+        self.assertEqual(self._rows(), set())
+        self.assertEqual(self._rows('can_delete_widget'), expected)
+
+    def test_last_login_update_does_not_refresh(self):
+        with self.assertNumQueries(1):
+            self.owner.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            materialize.refresh(registry._get_entry('can_edit_widget'), users=[], objects=None)
+
+    def test_materialize_requires_model(self):
+        self.assertRaises(
+            PermissionsError, registry.register, lambda u: True, name='perm', materialize=True)
+
+    def test_materialize_on_must_include_model(self):
+        self.assertRaises(
+            PermissionsError, registry.register, lambda u, w: True, name='perm', model=Widget,
+            materialize=True, materialize_on={User: lambda u: ([u], None)})
@@ -0,0 +1,138 @@
+from unittest import skipIf
+
+import django
+from django.conf.urls import url
+from django.http import HttpResponse
+from django.test import override_settings
+
+from ..exc import PermissionsError
+from ..middleware import MiddlewareMixin
+
+from .base import AnonymousUser, Model, PermissionsRegistry, TestCase, User
+
+
+registry = PermissionsRegistry()
+
+
+checks = []
+
+
+@registry.register(model=Model)
+def can_view(user, instance):
+    checks.append(instance.model_id)
+    return instance.model_id in user.viewable
+
+
+@registry.register
+def is_staff(user):
+    return user.is_staff
+
+
+views_called = []
+
+
+def view(request, model_id=None):
+    views_called.append(model_id)
+    return HttpResponse('ok')
+
+
+urlpatterns = [
+    registry.url(r'^things/(?P<model_id>\d+)$', view, perms='can_view', field='model_id'),
+    registry.url(r'^staff/things/(\d+)$', view, perms=['is_staff', 'can_view'], field='model_id'),
+    url(r'^open$', view),
+]
+
+
+class UserMiddleware(MiddlewareMixin):
+
+    def process_request(self, request):
+        user = request.META.get('HTTP_X_USER')
+        if user is None:
+            request.user = AnonymousUser()
+        else:
+            request.user = User(viewable=['1'], is_staff=(user == 'staff'))
+
+
+middleware = [
+    'permissions.tests.test_middleware.UserMiddleware',
+    'permissions.tests.test_middleware.PermissionsMiddleware',
+]
+
+
+PermissionsMiddleware = registry.middleware
+
+
+@override_settings(
+    ROOT_URLCONF='permissions.tests.test_middleware', MIDDLEWARE_CLASSES=middleware,
+    MIDDLEWARE=middleware)
+class TestMiddleware(TestCase):
+
+    def setUp(self):
+        super(TestMiddleware, self).setUp()
+        del views_called[:]
+        del checks[:]
+
+    def test_permitted(self):
+        response = self.client.get('/things/1', HTTP_X_USER='user')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(views_called, ['1'])
+        self.assertEqual(checks, ['1'])
+
+    def test_denied_before_view_is_called(self):
+        response = self.client.get('/things/2', HTTP_X_USER='user')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(views_called, [])
+
+    def test_anonymous_is_redirected_to_login(self):
+        response = self.client.get('/things/1')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(views_called, [])
+
+    def test_all_permissions_are_required(self):
+        self.assertEqual(self.client.get('/staff/things/1', HTTP_X_USER='user').status_code, 403)
+        self.assertEqual(self.client.get('/staff/things/1', HTTP_X_USER='staff').status_code, 200)
+        self.assertEqual(self.client.get('/staff/things/2', HTTP_X_USER='staff').status_code, 403)
+
+    def test_same_view_with_different_permissions(self):
+        callbacks = [p.callback for p in urlpatterns[:2]]
+        self.assertIsNot(callbacks[0], callbacks[1])
+        self.assertEqual(registry._url_permissions[callbacks[0]][0].perm_name, 'can_view')
+        self.assertEqual(registry._url_permissions[callbacks[1]][0].perm_name, 'is_staff')
+
+    def test_views_without_permissions_are_not_checked(self):
+        response = self.client.get('/open')
+        self.assertEqual(response.status_code, 200)
+
+    def test_entry_for_view(self):
+        self.assertIsNotNone(registry.entry_for_view(view, 'can_view'))
+
+    def test_protect_requires_view(self):
+        self.assertRaises(
+            PermissionsError, registry.protect, url(r'^nested/', ([], None, None)), 'is_staff')
+        self.assertRaises(
+            PermissionsError, registry.url, r'^nested/', ([], None, None), perms='is_staff')
+
+    @skipIf(django.VERSION[:2] >= (2, 0), 'django.urls.path() is available')
+    def test_path_requires_django_2(self):
+        self.assertRaises(PermissionsError, registry.path, 'things/', view, perms='is_staff')
+
+
+@override_settings(
+    ROOT_URLCONF='permissions.tests.test_middleware', MIDDLEWARE_CLASSES=middleware[:1],
+    MIDDLEWARE=middleware[:1])
+class TestWithoutMiddleware(TestCase):
+
+    def setUp(self):
+        super(TestWithoutMiddleware, self).setUp()
+        del views_called[:]
+
+    def test_permitted(self):
+        response = self.client.get('/things/1', HTTP_X_USER='user')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(views_called, ['1'])
+
+    def test_denied(self):
+        self.assertEqual(self.client.get('/things/2', HTTP_X_USER='user').status_code, 403)
+        self.assertEqual(self.client.get('/things/1').status_code, 302)
+        self.assertEqual(self.client.get('/staff/things/1', HTTP_X_USER='user').status_code, 403)
+        self.assertEqual(views_called, [])
@@ -1,9 +1,18 @@
+from unittest import skipIf
+
+import django
+from django.contrib.auth.models import Group, Permission, User as AuthUser
 from django.core.exceptions import PermissionDenied
+from django.http import Http404
 
 from permissions import PermissionsRegistry
 from permissions.exc import NoSuchPermissionError, PermissionsError
+from permissions.registry import FrozenTable
+from permissions.templatetags.permissions import register as library
 
 from .base import AnonymousUser, Model, TestCase, User, View
+from .base import PermissionsRegistry as StubPermissionsRegistry
+from .models import Org, Part, Project
 
 
 class TestRegistry(TestCase):
@@ -227,3 +236,381 @@ class TestRegistry(TestCase):
 
         user = User(is_staff=False, is_superuser=False)
         self.assertEqual(perm(user), 'perm')
+
+
+class TestMultiModel(TestCase):
+
+    def setUp(self):
+        super(TestMultiModel, self).setUp()
+        self.org = Org.objects.create(name='org')
+        self.project = Project.objects.create(org=self.org)
+        self.part = Part.objects.create(project=self.project)
+        self.other_project = Project.objects.create(org=Org.objects.create(name='other'))
+
+        self.registry = PermissionsRegistry()
+
+        @self.registry.register(models=(
+            (Org, 'org_id'),
+            (Project, 'project_id', 'org'),
+            (Part, 'part_id', 'project'),
+        ))
+        def can_edit_part(user, org, project, part):
+            return user.can_edit
+
+        self.can_edit_part = can_edit_part
+
+        @self.registry.require('can_edit_part')
+        def view(request, org_id, project_id, part_id):
+            pass
+
+        self.view = view
+
+    def _request(self, can_edit=True):
+        request = self.request_factory.get('/stuff/1')
+        request.user = User(can_edit=can_edit)
+        return request
+
+    def test_instances_are_loaded_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.view(
+                self._request(), org_id=self.org.pk, project_id=self.project.pk,
+                part_id=self.part.pk)
+        self.assertRaises(
+            PermissionDenied, self.view, self._request(can_edit=False), self.org.pk,
+            self.project.pk, self.part.pk)
+
+    def test_instances_must_belong_together(self):
+        self.assertRaises(
+            Http404, self.view, self._request(), self.org.pk, self.other_project.pk,
+            self.part.pk)
+
+    def test_unchained_models_are_loaded_separately(self):
+
+        @self.registry.register(models=((Org, 'org_id'), (Part, 'part_id')))
+        def can_move_part(user, org, part):
+            return isinstance(org, Org) and isinstance(part, Part)
+
+        @self.registry.require('can_move_part')
+        def view(request, org_id, part_id):
+            pass
+
+        with self.assertNumQueries(2):
+            view(self._request(), self.other_project.org_id, self.part.pk)
+
+    def test_direct_call_with_multiple_instances(self):
+        self.assertTrue(
+            self.can_edit_part(User(can_edit=True), self.org, self.project, self.part))
+        self.assertFalse(
+            self.can_edit_part(User(can_edit=False), self.org, self.project, self.part))
+
+    def test_model_and_models_are_exclusive(self):
+        self.assertRaises(
+            PermissionsError, self.registry.register, lambda u, o: True, name='perm',
+            model=Org, models=((Org, 'org_id'),))
+        self.assertRaises(
+            PermissionsError, self.registry.register, lambda u, o: True, name='perm',
+            models=((Org, 'org_id', 'parent'),))
+
+
+class TestLazyRegistry(TestCase):
+
+    def setUp(self):
+        super(TestLazyRegistry, self).setUp()
+        self.registry = StubPermissionsRegistry(lazy=True)
+
+        @self.registry.register(model=Model)
+        def can_view(user, instance):
+            return user.can_view
+
+        self.can_view = can_view
+
+    def test_permission_is_built_on_first_use(self):
+        self.assertIn('can_view', self.registry._pending)
+        self.assertNotIn('can_view', self.registry._registry)
+        self.assertTrue(self.can_view(User(can_view=True), Model()))
+        self.assertNotIn('can_view', self.registry._pending)
+        self.assertIn('can_view', self.registry._registry)
+
+    def test_view_inspection_is_deferred(self):
+
+        @self.registry.require('can_view')
+        def view(request, model_id):
+            pass
+
+        self.assertEqual(len(self.registry._uncompiled), 1)
+        request = self.request_factory.get('/things/1')
+        request.user = User(can_view=False)
+        self.assertRaises(PermissionDenied, view, request, 1)
+
+    def test_tables_are_updated_in_place(self):
+        # Copying the tables on each registration made boot time
+        # quadratic in the number of permissions.
+
+        def get_tables():
+            return self.registry._registry, self.registry._pending, library.filters
+
+        tables = get_tables()
+        with self.registry.override():
+            for i in range(3):
+                self.registry.register(lambda user: True, name='in_place_perm_{0}'.format(i))
+            self.assertTrue(all(a is b for (a, b) in zip(tables, get_tables())))
+        self.assertNotIn('in_place_perm_0', library.filters)
+
+    def test_freeze(self):
+
+        @self.registry.require('can_view')
+        def view(request, model_id):
+            pass
+
+        report = self.registry.freeze()
+        self.assertEqual(self.registry._pending, {})
+        self.assertEqual(self.registry._uncompiled, [])
+        self.assertIsInstance(self.registry._registry, FrozenTable)
+        self.assertEqual(report['tests'].permissions, 1)
+        self.assertEqual(report['tests'].views, 1)
+
+        request = self.request_factory.get('/things/1')
+        request.user = User(can_view=True)
+        view(request, 1)
+        self.assertFalse(self.can_view(User(can_view=False), Model()))
+        self.assertRaises(PermissionsError, self.registry.register, lambda u: True, name='perm')
+        self.assertRaises(NoSuchPermissionError, self.registry.require, 'perm')
+
+
+class TestUserPrefetch(TestCase):
+
+    def setUp(self):
+        super(TestUserPrefetch, self).setUp()
+        self.registry = PermissionsRegistry()
+
+        @self.registry.register(user_prefetch=['groups'])
+        def in_group(user):
+            return any(g.name == 'group' for g in user.groups.all())
+
+        @self.registry.register(model=Org, user_prefetch=['user_permissions__content_type'])
+        def has_org_perm(user, org):
+            return any(p.content_type.model == 'org' for p in user.user_permissions.all())
+
+        @self.registry.require('in_group')
+        def view(request):
+            pass
+
+        self.in_group = in_group
+        self.has_org_perm = has_org_perm
+        self.view = view
+
+        user = AuthUser.objects.create(username='user')
+        user.groups.add(Group.objects.create(name='group'))
+        user.user_permissions.add(Permission.objects.get(codename='add_org'))
+        self.user = AuthUser.objects.get(pk=user.pk)
+
+    def test_relations_are_loaded_once(self):
+        # Only the relations of the permission being checked are loaded.
+        with self.assertNumQueries(1):
+            self.assertTrue(self.in_group(self.user))
+        # user_permissions, content types
+        with self.assertNumQueries(2):
+            self.assertTrue(self.has_org_perm(self.user, Org()))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.has_org_perm(self.user, Org()))
+            self.assertTrue(self.in_group(self.user))
+
+    def test_relations_of_permissions_checked_together_are_loaded_together(self):
+        with self.assertNumQueries(3):
+            self.registry.fingerprint(self.user, ['in_group', 'has_org_perm'], Org())
+        with self.assertNumQueries(0):
+            self.assertTrue(self.in_group(self.user))
+            self.assertTrue(self.has_org_perm(self.user, Org()))
+
+    def test_view(self):
+        request = self.request_factory.get('/things')
+        request.user = self.user
+        with self.assertNumQueries(3):
+            self.view(request)
+            self.assertTrue(self.has_org_perm(self.user, Org()))
+
+
+class TestIterPermitted(TestCase):
+
+    def setUp(self):
+        super(TestIterPermitted, self).setUp()
+        self.registry = PermissionsRegistry(allow_staff=True)
+        self.batches = []
+
+        def batch(user, orgs):
+            self.batches.append(len(orgs))
+            return [org.name.startswith(user.username) for org in orgs]
+
+        @self.registry.register(model=Org, batch=batch)
+        def can_view_org(user, org):
+            raise AssertionError('batch should be used instead')
+
+        @self.registry.register(model=Org)
+        def can_edit_org(user, org):
+            return org.name.startswith(user.username)
+
+        self.user = AuthUser.objects.create(username='user')
+        for name in ('user-1', 'other-1', 'user-2', 'other-2', 'user-3'):
+            Org.objects.create(name=name)
+        self.orgs = Org.objects.order_by('pk')
+
+    def _names(self, orgs):
+        return [org.name for org in orgs]
+
+    def test_batch_is_called_per_chunk(self):
+        orgs = self.registry.iter_permitted('can_view_org', self.user, self.orgs, chunk_size=2)
+        self.assertEqual(self._names(orgs), ['user-1', 'user-2', 'user-3'])
+        self.assertEqual(self.batches, [2, 2, 1])
+
+    def test_objects_are_yielded_as_chunks_are_checked(self):
+        orgs = self.registry.iter_permitted('can_view_org', self.user, self.orgs, chunk_size=2)
+        self.assertEqual(next(orgs).name, 'user-1')
+        self.assertEqual(self.batches, [2])
+
+    def test_without_batch(self):
+        orgs = self.registry.iter_permitted('can_edit_org', self.user, self.orgs, chunk_size=2)
+        self.assertEqual(self._names(orgs), ['user-1', 'user-2', 'user-3'])
+
+    def test_bypass(self):
+        self.user.is_staff = True
+        orgs = self.registry.iter_permitted('can_view_org', self.user, self.orgs)
+        self.assertEqual(len(list(orgs)), 5)
+        self.assertEqual(self.batches, [])
+
+    def test_filter_uses_batch(self):
+        orgs = self.registry.filter('can_view_org', self.user, self.orgs)
+        self.assertEqual(self._names(orgs), ['user-1', 'user-2', 'user-3'])
+        self.assertEqual(self.batches, [5])
+
+    def test_batch_requires_model(self):
+        with self.assertRaises(PermissionsError):
+            self.registry.register(lambda user: True, name='perm', batch=lambda u, i: [])
+
+    def test_permission_must_have_model(self):
+        self.registry.register(lambda user: True, name='perm')
+        for perm_name in ('perm', 'no_such_perm'):
+            self.assertRaises(
+                PermissionsError, self.registry.iter_permitted, perm_name, self.user, self.orgs)
+            self.assertRaises(
+                PermissionsError, self.registry.filter, perm_name, self.user, self.orgs)
+
+
+class TestFingerprint(TestCase):
+
+    def setUp(self):
+        super(TestFingerprint, self).setUp()
+
+        @self.registry.register
+        def can_do(user):
+            return 'can_do' in user.permissions
+
+        @self.registry.register(model=Model)
+        def can_do_with_model(user, instance):
+            return instance.owner == user.username
+
+    def test_same_results_give_same_fingerprint(self):
+        names = ['can_do', 'can_do_with_model']
+        instance = Model(owner='a')
+        fingerprint = self.registry.fingerprint(
+            User(username='a', permissions=['can_do']), names, instance)
+        self.assertEqual(
+            fingerprint,
+            self.registry.fingerprint(
+                User(username='a', permissions=['can_do']), reversed(names), instance))
+        self.assertNotEqual(
+            fingerprint,
+            self.registry.fingerprint(User(username='b', permissions=['can_do']), names, instance))
+        self.assertNotEqual(
+            fingerprint,
+            self.registry.fingerprint(User(username='a'), names, instance))
+
+    def test_fingerprint_depends_on_permission_names(self):
+        user = User(username='b')
+        self.assertNotEqual(
+            self.registry.fingerprint(user, ['can_do']),
+            self.registry.fingerprint(user, ['can_do', 'can_do_with_model'], Model(owner='a')))
+
+    def test_instance_is_required_for_model_permissions(self):
+        self.assertRaises(
+            PermissionsError, self.registry.fingerprint, User(), ['can_do_with_model'])
+
+
+@skipIf(django.VERSION[:2] < (1, 8), 'Conditional expressions require Django 1.8')
+class TestAnnotate(TestCase):
+
+    def setUp(self):
+        super(TestAnnotate, self).setUp()
+        self.registry = PermissionsRegistry(allow_superuser=True)
+
+        def filter_orgs(user, queryset):
+            return queryset.filter(name__startswith=user.username)
+
+        @self.registry.register(model=Org, filter_queryset=filter_orgs)
+        def can_edit_org(user, org):
+            return org.name.startswith(user.username)
+
+        @self.registry.register(model=Org)
+        def can_delete_org(user, org):
+            self.checked.append(org.name)
+            return org.name.endswith('1')
+
+        @self.registry.register
+        def is_active(user):
+            return user.is_active
+
+        self.checked = []
+        self.user = AuthUser.objects.create(username='user')
+        for name in ('user-1', 'other-1', 'user-2'):
+            Org.objects.create(name=name)
+        self.orgs = Org.objects.order_by('name')
+
+    def _flags(self, orgs, *names):
+        return [tuple(getattr(org, n) for n in names) for org in orgs]
+
+    def test_annotate(self):
+        orgs = self.registry.annotate(self.orgs, self.user, ['can_edit_org', 'can_delete_org'])
+        # can_delete_org has no SQL form, so it's checked in Python
+        # when annotating. All the flags arrive with the rows.
+        with self.assertNumQueries(1):
+            flags = self._flags(orgs, 'name', 'can_edit_org', 'can_delete_org')
+        self.assertEqual(flags, [
+            ('other-1', False, True),
+            ('user-1', True, True),
+            ('user-2', True, False),
+        ])
+
+    def test_aliases(self):
+        orgs = self.registry.annotate(self.orgs, self.user, {'can_edit': 'can_edit_org'})
+        self.assertEqual(self._flags(orgs, 'can_edit'), [(False,), (True,), (True,)])
+
+    def test_bypass(self):
+        self.user.is_superuser = True
+        with self.assertNumQueries(1):
+            orgs = self.registry.annotate(
+                self.orgs, self.user, ['can_edit_org', 'can_delete_org'])
+            flags = self._flags(orgs, 'can_edit_org', 'can_delete_org')
+        self.assertEqual(flags, [(True, True)] * 3)
+
+    def test_no_permitted_objects(self):
+        orgs = self.orgs.filter(name='user-2')
+        orgs = self.registry.annotate(orgs, self.user, ['can_delete_org'])
+        self.assertEqual(self._flags(orgs, 'can_delete_org'), [(False,)])
+
+    def test_permission_without_model(self):
+        self.assertRaises(
+            PermissionsError, self.registry.annotate, self.orgs, self.user, ['is_active'])
+
+    def test_only_fetched_rows_are_checked(self):
+        orgs = self.registry.annotate(self.orgs, self.user, ['can_edit_org', 'can_delete_org'])
+        self.assertEqual(self.checked, [])
+        page = orgs.filter(name__startswith='user')[1:]
+        self.assertEqual(self._flags(page, 'name', 'can_delete_org'), [('user-2', False)])
+        self.assertEqual(self.checked, ['user-2'])
+        self.assertTrue(orgs.get(name='user-1').can_delete_org)
+
+    def test_chunks(self):
+        orgs = self.registry.annotate(self.orgs, self.user, ['can_delete_org'], chunk_size=2)
+        self.assertEqual(
+            self._flags(orgs.iterator(), 'can_delete_org'), [(True,), (True,), (False,)])
+        self.assertEqual(
+            list(orgs.values_list('name', flat=True)), ['other-1', 'user-1', 'user-2'])
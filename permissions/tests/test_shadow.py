@@ -0,0 +1,91 @@
+import threading
+
+from django.core.exceptions import PermissionDenied
+
+from permissions.exc import PermissionsError
+
+from .base import Model, PermissionsRegistry, TestCase, User
+
+
+class TestShadow(TestCase):
+
+    def setUp(self):
+        super(TestShadow, self).setUp()
+        self.registry = PermissionsRegistry()
+
+        @self.registry.register(model=Model)
+        def can_edit(user, instance):
+            return instance.owner_id == user.pk
+
+        @self.registry.require('can_edit', field='owner_id')
+        def view(request, owner_id):
+            return 'ok'
+
+        self.can_edit = can_edit
+        self.view = view
+        self.user = User(pk=1)
+
+    def test_agreeing_candidate(self):
+        calling_threads = []
+
+        @self.registry.shadow('can_edit', sample_rate=1)
+        def can_edit_v2(user, instance):
+            calling_threads.append(threading.current_thread())
+            return user.pk == instance.owner_id
+
+        self.assertTrue(self.can_edit(self.user, Model(owner_id=1)))
+        self.assertFalse(self.can_edit(self.user, Model(owner_id=2)))
+        report = self.registry.shadow_report('can_edit', flush=True)
+        self.assertEqual((report.sampled, report.compared, report.agreed), (2, 2, 2))
+        self.assertEqual(report.disagreed, 0)
+        self.assertEqual(report.primary_latency.count, 2)
+        self.assertEqual(report.candidate_latency.count, 2)
+        self.assertNotIn(threading.current_thread(), calling_threads)
+
+    def test_disagreement_does_not_change_result(self):
+        self.registry.shadow('can_edit', lambda user, instance: True, sample_rate=1)
+        request = self.request_factory.get('/things')
+        request.user = self.user
+        self.assertRaises(PermissionDenied, self.view, request, 2)
+        report = self.registry.shadow_report('can_edit', flush=True)
+        self.assertEqual(report.disagreed, 1)
+        disagreement = report.disagreements[0]
+        self.assertEqual(disagreement.user_id, 1)
+        self.assertFalse(disagreement.primary)
+        self.assertTrue(disagreement.candidate)
+
+    def test_candidate_errors_are_counted(self):
+        def can_edit_v2(user, instance):
+            raise ValueError()
+
+        self.registry.shadow('can_edit', can_edit_v2, sample_rate=1, background=False)
+        self.assertTrue(self.can_edit(self.user, Model(owner_id=1)))
+        report = self.registry.shadow_report('can_edit')
+        self.assertEqual((report.sampled, report.compared, report.errors), (1, 0, 1))
+
+    def test_sampling(self):
+        self.registry.shadow('can_edit', lambda user, instance: True, sample_rate=0)
+        self.can_edit(self.user, Model(owner_id=1))
+        self.assertEqual(self.registry.shadow_report('can_edit').sampled, 0)
+
+    def test_full_queue_drops_samples(self):
+        release = threading.Event()
+
+        def can_edit_v2(user, instance):
+            release.wait()
+            return True
+
+        self.registry.shadow('can_edit', can_edit_v2, sample_rate=1, max_queue_size=1)
+        for _ in range(5):
+            self.can_edit(self.user, Model(owner_id=1))
+        release.set()
+        report = self.registry.unshadow('can_edit')
+        self.assertEqual(report.sampled, 5)
+        self.assertGreaterEqual(report.dropped, 3)
+        self.assertEqual(report.compared + report.dropped, 5)
+
+    def test_unshadow(self):
+        self.registry.shadow('can_edit', lambda user, instance: True, sample_rate=1)
+        self.registry.unshadow('can_edit')
+        self.assertRaises(PermissionsError, self.registry.shadow_report, 'can_edit')
+        self.assertRaises(PermissionsError, self.registry.unshadow, 'can_edit')
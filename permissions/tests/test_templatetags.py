@@ -70,6 +70,17 @@ class TestTemplateTags(TestCase):
         self.assertNotIn('can_do_with_model', filters_called)
         self.assertNotIn('can_do_with_model', result)
 
+    def test_lazy_registry(self):
+        self.registry = PermissionsRegistry(lazy=True)
+        self.registry.register(can_do)
+        self.registry.register(can_do_with_model, model=Model)
+        self.assertIn('can_do', self.registry._pending)
+        user = User(permissions=['can_do', 'can_do_with_model'])
+        context = Context({'user': user, 'instance': Model()})
+        result = self.template.render(context)
+        self.assertIn('can_do', result)
+        self.assertIn('can_do_with_model', result)
+
     def test_check_is_not_short_circuited_when_allow_anonymous_is_set(self):
         self.registry.register(can_do, allow_anonymous=True, replace=True)
         user = AnonymousUser()
@@ -77,3 +88,23 @@ class TestTemplateTags(TestCase):
         result = self.template.render(context)
         self.assertNotIn('can_do_with_model', filters_called)
         self.assertNotIn('can_do_with_model', result)
+
+    def test_fingerprint(self):
+        template = Template(
+            '{% load permissions %}'
+            '{% permissions_fingerprint user "can_do_with_model" "can_do" '
+            'instance=instance as fp %}'
+            '{{ fp }}'
+        )
+
+        def render(user):
+            return template.render(Context({'user': user, 'instance': Model()}))
+
+        both = render(User(permissions=['can_do', 'can_do_with_model']))
+        self.assertEqual(both, render(User(permissions=['can_do_with_model', 'can_do'])))
+        self.assertNotEqual(both, render(User(permissions=['can_do'])))
+        self.assertEqual(
+            both,
+            self.registry.fingerprint(
+                User(permissions=['can_do', 'can_do_with_model']), ['can_do', 'can_do_with_model'],
+                Model()))
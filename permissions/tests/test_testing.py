@@ -0,0 +1,133 @@
+import threading
+
+from django.core.exceptions import PermissionDenied
+from django.template import Context, Template
+
+from permissions import PermissionsRegistry
+
+from .base import TestCase, User
+from .models import Org
+
+
+class TestOverride(TestCase):
+
+    def setUp(self):
+        super(TestOverride, self).setUp()
+        self.registry = PermissionsRegistry()
+
+        @self.registry.register(model=Org)
+        def can_edit_org(user, org):
+            return org.name == user.org_name
+
+        @self.registry.require('can_edit_org')
+        def view(request, org_id):
+            return 'ok'
+
+        self.can_edit_org = can_edit_org
+        self.view = view
+
+    def _request(self, org_name='stub'):
+        request = self.request_factory.get('/things/1')
+        request.user = User(org_name=org_name)
+        return request
+
+    def test_forced_decisions_skip_perm_func_and_instance_loading(self):
+        with self.assertNumQueries(0):
+            with self.registry.override(allow=['can_edit_org']):
+                self.assertEqual(self.view(self._request(org_name=None), 1), 'ok')
+                self.assertTrue(self.can_edit_org(User(), None))
+            with self.registry.override(deny=['can_edit_org']):
+                self.assertRaises(PermissionDenied, self.view, self._request(), 1)
+
+    def test_stub_instances(self):
+        stub = lambda pk: Org(pk=pk, name='stub')
+        with self.assertNumQueries(0):
+            with self.registry.override(instances={Org: stub}):
+                self.assertEqual(self.view(self._request(), 1), 'ok')
+                self.assertRaises(PermissionDenied, self.view, self._request('other'), 1)
+
+    def test_nested_overrides(self):
+        with self.registry.override(deny=['can_edit_org'], instances={Org: Org(name='stub')}):
+            with self.registry.override(allow=['can_edit_org']):
+                self.assertEqual(self.view(self._request('other'), 1), 'ok')
+            self.assertRaises(PermissionDenied, self.view, self._request(), 1)
+
+    def test_registrations_and_template_filters_are_restored(self):
+        source = '{% load permissions %}{% if user|can_edit_org:org %}yes{% endif %}'
+        context = Context({'user': User(org_name='stub'), 'org': Org(name='stub')})
+        with self.registry.override():
+            self.registry.register(lambda user, org: False, name='can_edit_org', replace=True)
+            self.registry.register(lambda user: True, name='can_do_anything')
+            self.assertEqual(Template(source).render(context), '')
+        self.assertNotIn('can_do_anything', self.registry._registry)
+        self.assertEqual(Template(source).render(context), 'yes')
+
+    def test_decorator(self):
+
+        @self.registry.override(deny=['can_edit_org'])
+        def check():
+            return self.can_edit_org(User(org_name='stub'), Org(name='stub'))
+
+        self.assertFalse(check())
+        self.assertTrue(self.can_edit_org(User(org_name='stub'), Org(name='stub')))
+
+    def test_overrides_are_per_thread(self):
+        results = []
+        with self.registry.override(deny=['can_edit_org']):
+            thread = threading.Thread(
+                target=lambda: results.append(
+                    self.can_edit_org(User(org_name='stub'), Org(name='stub'))))
+            thread.start()
+            thread.join()
+            results.append(self.can_edit_org(User(org_name='stub'), Org(name='stub')))
+        self.assertEqual(results, [True, False])
+
+    def test_concurrent_overrides_only_restore_their_own_registrations(self):
+        entered, exited = threading.Event(), threading.Event()
+        errors = []
+
+        def other_thread():
+            try:
+                with self.registry.override():
+                    self.registry.register(lambda user: True, name='from_other_override')
+                    entered.set()
+                    exited.wait(5)
+                    self.assertIn('from_other_override', self.registry._registry)
+                self.assertNotIn('from_other_override', self.registry._registry)
+            except Exception as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=other_thread)
+        with self.registry.override():
+            thread.start()
+            entered.wait(5)
+            self.registry.register(lambda user: True, name='from_override')
+        exited.set()
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertNotIn('from_override', self.registry._registry)
+        self.assertIn('can_edit_org', self.registry._registry)
+
+    def test_registrations_in_other_threads_are_kept(self):
+        with self.registry.override():
+            thread = threading.Thread(
+                target=self.registry.register, args=(lambda user: True,),
+                kwargs={'name': 'from_thread'})
+            thread.start()
+            thread.join()
+        self.assertIn('from_thread', self.registry._registry)
+
+
+registry = PermissionsRegistry()
+
+
+@registry.register
+def can_do_things(user):
+    raise AssertionError('Permission function should not be called')
+
+
+@registry.override(allow=['can_do_things'])
+class TestOverrideClassDecorator(TestCase):
+
+    def test_override_is_active(self):
+        self.assertTrue(can_do_things(User()))
@@ -0,0 +1,173 @@
+import threading
+from timeit import default_timer
+
+from django.core.exceptions import PermissionDenied
+from django.db import OperationalError
+
+from permissions.exc import PermissionsError
+from permissions.timeouts import (
+    _get_statement_timeout_sql, _set_worker_statement_timeout, _worker, is_statement_timeout)
+
+from .base import Model, PermissionsRegistry, TestCase, User
+from .models import Org
+
+
+class TestTimeouts(TestCase):
+
+    def setUp(self):
+        super(TestTimeouts, self).setUp()
+        self.registry = PermissionsRegistry(timeout_workers=2)
+        self.release = threading.Event()
+
+        @self.registry.register(timeout=0.05)
+        def is_slow(user):
+            self.release.wait(5)
+            return True
+
+        @self.registry.register(timeout=0.05, timeout_fallback=True)
+        def is_slow_with_fallback(user):
+            self.release.wait(5)
+            return False
+
+        @self.registry.register(timeout=1)
+        def is_fast(user):
+            return user.is_fast
+
+        @self.registry.register(timeout=1)
+        def is_broken(user):
+            raise ValueError()
+
+        @self.registry.require('is_slow')
+        def view(request):
+            pass
+
+        self.is_slow = is_slow
+        self.is_slow_with_fallback = is_slow_with_fallback
+        self.is_fast = is_fast
+        self.is_broken = is_broken
+        self.view = view
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_fast_permission(self):
+        self.assertTrue(self.is_fast(User(is_fast=True)))
+        self.assertFalse(self.is_fast(User(is_fast=False)))
+        self.assertEqual(self.registry.timeout_counts, {})
+
+    def test_slow_permission_is_denied(self):
+        start_time = default_timer()
+        self.assertFalse(self.is_slow(User()))
+        self.assertLess(default_timer() - start_time, 1)
+        self.assertEqual(self.registry.timeout_counts, {'is_slow': 1})
+
+    def test_fallback(self):
+        self.assertTrue(self.is_slow_with_fallback(User()))
+
+    def test_view(self):
+        request = self.request_factory.get('/things')
+        request.user = User()
+        self.assertRaises(PermissionDenied, self.view, request)
+
+    def test_exceptions_are_raised(self):
+        self.assertRaises(ValueError, self.is_broken, User())
+
+    def test_workers_are_reused(self):
+        for _ in range(5):
+            self.is_slow(User())
+        self.assertEqual(len(self.registry._timeout_pools[('is_slow', 0.05)]._threads), 2)
+        self.assertEqual(self.registry.timeout_counts, {'is_slow': 5})
+
+    def test_stalled_permission_does_not_block_others(self):
+        for _ in range(3):
+            self.assertFalse(self.is_slow(User()))
+        self.assertTrue(self.is_fast(User(is_fast=True)))
+        self.assertEqual(self.registry.timeout_counts, {'is_slow': 3})
+
+    def test_statement_timeout_is_set_on_worker_connections(self):
+        executed = []
+
+        class Cursor(object):
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                pass
+
+            def execute(self, sql, params):
+                executed.append((sql, params))
+
+        class Connection(object):
+
+            vendor = 'postgresql'
+
+            def cursor(self):
+                return Cursor()
+
+        _set_worker_statement_timeout(None, Connection())
+        self.assertEqual(executed, [])
+        _worker.timeout = 0.05
+        try:
+            _set_worker_statement_timeout(None, Connection())
+        finally:
+            del _worker.timeout
+        self.assertEqual(executed, [('SET statement_timeout = %s', [50])])
+
+    def test_batch(self):
+        def batch(user, instances):
+            self.release.wait(5)
+            return [True] * len(instances)
+
+        self.registry.register(
+            lambda user, instance: True, name='can_batch', model=Model, batch=batch,
+            timeout=0.05)
+        instances = [Model(), Model()]
+        entry = self.registry._get_entry('can_batch')
+        self.assertEqual(self.registry._evaluate_many(entry, User(), instances), [False, False])
+
+    def test_timeout_must_be_positive(self):
+        self.assertRaises(
+            PermissionsError, self.registry.register, lambda user: True, name='perm', timeout=0)
+
+    def test_in_thread_sees_uncommitted_data(self):
+
+        @self.registry.register(model=Org, timeout=1, timeout_thread=False)
+        def can_view_org(user, org):
+            return Org.objects.filter(pk=org.pk, name=user.username).exists()
+
+        org = Org.objects.create(name='user')
+        with self.assertNumQueries(1):
+            self.assertTrue(can_view_org(User(username='user'), org))
+        self.assertFalse(can_view_org(User(username='other'), org))
+        self.assertEqual(self.registry._timeout_pools, {})
+
+    def test_in_thread_statement_timeout(self):
+
+        @self.registry.register(timeout=1, timeout_thread=False, timeout_fallback=True)
+        def is_cancelled(user):
+            raise OperationalError(3024, 'Query interrupted')
+
+        self.assertTrue(is_cancelled(User()))
+        self.assertEqual(self.registry.timeout_counts, {'is_cancelled': 1})
+
+    def test_timeout_thread_requires_timeout(self):
+        self.assertRaises(
+            PermissionsError, self.registry.register, lambda user: True, name='perm',
+            timeout_thread=False)
+
+    def test_statement_timeout_sql(self):
+        self.assertIn('statement_timeout', _get_statement_timeout_sql('postgresql')[1])
+        self.assertIn('max_execution_time', _get_statement_timeout_sql('mysql')[1])
+        self.assertEqual(_get_statement_timeout_sql('sqlite'), (None, None))
+
+    def test_is_statement_timeout(self):
+        class QueryCanceledError(Exception):
+            pgcode = '57014'
+
+        exc = OperationalError()
+        exc.__cause__ = QueryCanceledError()
+        self.assertTrue(is_statement_timeout(exc))
+        self.assertTrue(is_statement_timeout(OperationalError(3024, 'Query interrupted')))
+        self.assertFalse(is_statement_timeout(OperationalError()))
+        self.assertFalse(is_statement_timeout(ValueError()))
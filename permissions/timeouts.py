@@ -0,0 +1,219 @@
+"""Deadlines for slow permission functions.
+
+Permissions registered with ``timeout`` are evaluated in a pool of
+reusable worker threads. Each permission has its own pool. The calling
+thread waits for the result until the deadline passes, at which point
+the permission's fallback decision is used instead. Worker threads
+can't be interrupted, so a stalled permission function keeps its
+worker busy until it returns; calls queued behind it are skipped if
+their deadlines have passed by the time a worker is free. Since pools
+aren't shared, a permission that's consistently slow only uses up its
+own workers and doesn't cause other permissions to time out.
+
+When a worker opens a database connection, a statement timeout
+matching the deadline is set on it where the backend supports it
+(PostgreSQL's ``statement_timeout`` and MySQL's
+``max_execution_time``; SQLite doesn't have one), so slow queries are
+cancelled by the database too. A query cancelled this way is treated
+as a timeout. This is done once per connection, so permission
+functions that don't query the database don't pay for it.
+
+Because workers use their own database connections, permission
+functions run this way only see committed data. They don't see changes
+made in the calling thread's transaction (including the one a test
+case wraps each test in). Permissions registered with
+``timeout_thread=False`` are instead run in the calling thread by
+:func:`call_with_statement_timeout`. Their queries are bounded by the
+statement timeout, but nothing else is, and on backends without
+a statement timeout (e.g. SQLite) there's no bound at all.
+
+"""
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+
+import six
+from django.db import (
+    DEFAULT_DB_ALIAS, OperationalError, close_old_connections, connections, transaction)
+from django.db.backends.signals import connection_created
+from six.moves import queue
+
+
+log = logging.getLogger(__name__)
+
+
+# Holds the statement timeout for connections opened by the current
+# worker thread.
+_worker = threading.local()
+
+
+class PermissionTimeout(Exception):
+
+    pass
+
+
+class _Call(object):
+
+    __slots__ = ('func', 'args', 'kwargs', 'timeout', 'event', 'result', 'exc_info', 'abandoned')
+
+    def __init__(self, func, args, kwargs, timeout):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.abandoned = False
+
+
+def _get_statement_timeout_sql(vendor):
+    """Get SQL for getting and setting a statement timeout in ms."""
+    if vendor == 'postgresql':
+        return 'SHOW statement_timeout', 'SET statement_timeout = %s'
+    elif vendor == 'mysql':
+        return 'SELECT @@SESSION.max_execution_time', 'SET SESSION max_execution_time = %s'
+    return None, None
+
+
+@contextmanager
+def statement_timeout(seconds, using=DEFAULT_DB_ALIAS):
+    """Limit how long each query may run on the ``using`` connection.
+
+    The previous limit is restored on exit. This does nothing for
+    backends without a per-session statement timeout.
+
+    """
+    connection = connections[using]
+    get_sql, set_sql = _get_statement_timeout_sql(connection.vendor)
+    if get_sql is None:
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(get_sql)
+        previous = cursor.fetchone()[0]
+        cursor.execute(set_sql, [max(1, int(seconds * 1000))])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(set_sql, [previous])
+
+
+def _set_worker_statement_timeout(sender, connection, **kwargs):
+    """Set the statement timeout on connections opened by workers."""
+    timeout = getattr(_worker, 'timeout', None)
+    if timeout is None:
+        return
+    set_sql = _get_statement_timeout_sql(connection.vendor)[1]
+    if set_sql is not None:
+        with connection.cursor() as cursor:
+            cursor.execute(set_sql, [max(1, int(timeout * 1000))])
+
+
+connection_created.connect(_set_worker_statement_timeout)
+
+
+def is_statement_timeout(exc):
+    """Check whether a database error is due to a statement timeout."""
+    if not isinstance(exc, OperationalError):
+        return False
+    cause = getattr(exc, '__cause__', None)
+    # query_canceled in PostgreSQL; ER_QUERY_TIMEOUT in MySQL
+    return (
+        getattr(cause, 'pgcode', None) == '57014' or
+        bool(exc.args) and exc.args[0] == 3024)
+
+
+def call_with_statement_timeout(func, args=(), kwargs=None, timeout=None, using=DEFAULT_DB_ALIAS):
+    """Call ``func`` in the calling thread with a statement timeout.
+
+    :class:`PermissionTimeout` is raised if the statement timeout
+    cancels one of ``func``'s queries. Within a transaction, ``func``
+    is run in a savepoint so that a cancelled query doesn't break the
+    rest of the transaction.
+
+    """
+    kwargs = kwargs or {}
+    connection = connections[using]
+    has_timeout = _get_statement_timeout_sql(connection.vendor)[0] is not None
+    try:
+        with statement_timeout(timeout, using):
+            if has_timeout and connection.in_atomic_block:
+                # A cancelled query aborts the transaction on PostgreSQL.
+                with transaction.atomic(using):
+                    return func(*args, **kwargs)
+            return func(*args, **kwargs)
+    except OperationalError as exc:
+        if is_statement_timeout(exc):
+            raise PermissionTimeout()
+        raise
+
+
+class WorkerPool(object):
+
+    """A pool of worker threads for calls with a deadline.
+
+    Threads are started as needed, up to ``max_workers``, and are
+    reused. Database connections opened by the workers have their
+    statement timeout set to ``timeout``.
+
+    """
+
+    def __init__(self, max_workers=10, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle = 0
+
+    def call(self, func, args=(), kwargs=None, timeout=None):
+        """Call ``func`` in a worker thread and wait up to ``timeout``.
+
+        Returns the result of ``func`` or re-raises its exception.
+        :class:`PermissionTimeout` is raised if the deadline passes
+        first or if a statement timeout cancels one of its queries.
+
+        """
+        call = _Call(func, args, kwargs or {}, timeout)
+        self._ensure_worker()
+        self._queue.put(call)
+        if not call.event.wait(timeout):
+            call.abandoned = True
+            raise PermissionTimeout()
+        if call.exc_info is not None:
+            if is_statement_timeout(call.exc_info[1]):
+                raise PermissionTimeout()
+            six.reraise(*call.exc_info)
+        return call.result
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._idle > self._queue.qsize() or len(self._threads) >= self.max_workers:
+                return
+            thread = threading.Thread(
+                target=self._run, name='permissions-timeout-{0}'.format(len(self._threads)))
+            thread.daemon = True
+            self._threads.append(thread)
+            self._idle += 1
+        thread.start()
+
+    def _run(self):
+        _worker.timeout = self.timeout
+        while True:
+            call = self._queue.get()
+            if call.abandoned:
+                continue
+            with self._lock:
+                self._idle -= 1
+            try:
+                close_old_connections()
+                call.result = call.func(*call.args, **call.kwargs)
+            except Exception:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    self._idle += 1
+                call.event.set()